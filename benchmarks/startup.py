@@ -0,0 +1,118 @@
+"""
+Cold-start benchmark for the API: import time, lifespan startup and first response.
+
+Each run starts a fresh interpreter, so module imports are measured cold:
+
+    python -m benchmarks.startup --runs 5
+
+The median of each phase is checked against ``--max-import-seconds`` and
+``--max-startup-seconds`` (import plus lifespan startup); the exit code is 1 when a
+budget is exceeded. Set ``--backend gemini`` (with ``API_KEY``) and ``--warmup-models``
+to include SDK warm-up in the startup phase.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import statistics
+import multiprocessing
+from typing import Any, Dict, List
+
+
+def run_once(options: Dict[str, Any]) -> Dict[str, Any]:
+    os.environ["MODEL_BACKEND"] = options["backend"]
+    os.environ["WARMUP_MODELS"] = options["warmup_models"]
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ["JOB_DB_PATH"] = os.path.join(workdir, "jobs.db")
+
+        start = time.perf_counter()
+        from src.api import main
+        imported = time.perf_counter()
+
+        async def serve():
+            import httpx
+
+            async with main.app.router.lifespan_context(main.app):
+                started = time.perf_counter()
+                transport = httpx.ASGITransport(app=main.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                    response = await client.get("/")
+                    response.raise_for_status()
+                return started, time.perf_counter()
+
+        lifespan_start = time.perf_counter()
+        started, answered = asyncio.run(serve())
+
+    return {
+        "import_seconds": round(imported - start, 4),
+        "lifespan_seconds": round(started - lifespan_start, 4),
+        "startup_seconds": round(imported - start + started - lifespan_start, 4),
+        "first_request_seconds": round(answered - started, 4),
+        "modules": len(sys.modules),
+        # Whether the Gemini SDK was imported before the first model call
+        "sdk_loaded": "google.generativeai" in sys.modules,
+        # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1
+        ),
+    }
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    summary = {}
+    for key, value in runs[0].items():
+        if isinstance(value, bool):
+            summary[key] = any(run[key] for run in runs)
+        else:
+            summary[key] = statistics.median_low(run[key] for run in runs)
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--backend", default="simulator")
+    parser.add_argument("--warmup-models", default="")
+    parser.add_argument("--max-import-seconds", type=float, default=1.0)
+    parser.add_argument("--max-startup-seconds", type=float, default=1.5)
+    parser.add_argument("--output", help="Write the runs and their medians as JSON to this file")
+    args = parser.parse_args(argv)
+
+    options = {"backend": args.backend, "warmup_models": args.warmup_models}
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    print(f"{'run':<6}{'import (s)':>12}{'lifespan (s)':>14}{'first req (s)':>15}{'modules':>9}{'rss (MB)':>10}")
+    for run in range(args.runs):
+        with context.Pool(1) as pool:
+            result = pool.apply(run_once, (options,))
+        runs.append(result)
+        print(
+            f"{run:<6}{result['import_seconds']:>12}{result['lifespan_seconds']:>14}"
+            f"{result['first_request_seconds']:>15}{result['modules']:>9}{result['peak_rss_mb']:>10}"
+        )
+    summary = summarize(runs)
+    print(
+        f"{'median':<6}{summary['import_seconds']:>12}{summary['lifespan_seconds']:>14}"
+        f"{summary['first_request_seconds']:>15}{summary['modules']:>9}{summary['peak_rss_mb']:>10}"
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"runs": runs, "median": summary}, f, indent=2)
+
+    failures = []
+    if summary["import_seconds"] > args.max_import_seconds:
+        failures.append(f"import took {summary['import_seconds']}s (budget {args.max_import_seconds}s)")
+    if summary["startup_seconds"] > args.max_startup_seconds:
+        failures.append(f"startup took {summary['startup_seconds']}s (budget {args.max_startup_seconds}s)")
+    for failure in failures:
+        print(f"Over budget: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+Throughput benchmarks for the generation paths, run against the local simulator backend.
+
+Each (path, concurrency) case runs in a fresh process so peak RSS is per case:
+
+    python -m benchmarks.throughput --paths single,packed,multi,batch,http --concurrency 1,8,32
+
+Pass ``--output results.json`` to save the results and ``--baseline results.json`` to
+fail (exit code 1) when samples/sec drops by more than ``--max-regression``.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from typing import Any, Dict, List
+
+PATHS = ("single", "packed", "multi", "batch", "http")
+
+
+class TimedBackend:
+    """Wrap a backend and record the latency of every upstream call."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.models = backend.models
+        self.latencies: List[float] = []
+
+    def supports(self, model: str) -> bool:
+        return self.backend.supports(model)
+
+    def max_candidates(self, model: str) -> int:
+        return self.backend.max_candidates(model)
+
+    def supports_json(self, model: str) -> bool:
+        return self.backend.supports_json(model)
+
+    async def _timed(self, call):
+        start = time.perf_counter()
+        try:
+            return await call
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    async def generate(self, model, prompt, **kwargs):
+        return await self._timed(self.backend.generate(model, prompt, **kwargs))
+
+    async def chat(self, model, history, message):
+        return await self._timed(self.backend.chat(model, history, message))
+
+    async def warm_up(self, models):
+        await self.backend.warm_up(models)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def _run_path(path: str, generator, samples: int, num_turns: int, workdir: str) -> int:
+    model = "gemini-1.5-flash"
+    if path == "single":
+        async for _ in generator.generate_single_turn_dataset_stream(
+            "Benchmark prompt", samples, model, False, os.path.join(workdir, "single.jsonl")
+        ):
+            pass
+        return samples
+    if path == "packed":
+        # gemini-pro has neither several candidates nor a JSON mode, so its packs must fall back
+        for packed_model in (model, "gemini-pro"):
+            async for _ in generator.generate_single_turn_dataset_stream(
+                "Benchmark prompt", samples // 2, packed_model, False, os.path.join(workdir, f"{packed_model}.jsonl"),
+                samples_per_call="auto"
+            ):
+                pass
+        return samples // 2 * 2
+    if path == "multi":
+        async for _ in generator.generate_multi_turn_dataset_stream(
+            "Benchmark prompt", num_turns, samples, model, False, os.path.join(workdir, "multi.jsonl")
+        ):
+            pass
+        return samples
+    if path == "batch":
+        requests = [
+            {"prompt": f"Benchmark prompt {idx}", "num_samples": samples // 4, "num_turns": num_turns if idx % 2 else None}
+            for idx in range(4)
+        ]
+        await generator.generate_batch_dataset(requests, os.path.join(workdir, "batch.json"), model, False)
+        return sum(request["num_samples"] for request in requests)
+    if path == "http":
+        import httpx
+        from src.api import main
+
+        main.generator = generator
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            async with client.stream("POST", "/generate/multi-turn", json={
+                "prompt": "Benchmark prompt", "num_turns": num_turns, "model": model, "num_conversations": samples
+            }) as response:
+                async for _ in response.aiter_lines():
+                    pass
+        return samples
+    raise ValueError(f"Unknown benchmark path: {path}")
+
+
+def run_case(path: str, concurrency: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    # Anything constructed from the environment (e.g. the API's module-level generator)
+    # must not reach for a real provider
+    os.environ["MODEL_BACKEND"] = "simulator"
+    from src.backends import SimulatedBackend
+    from src.gemini_client import GeminiClient
+    from src.generator import DatasetGenerator
+
+    backend = TimedBackend(SimulatedBackend(
+        latency_distribution=options["latency_distribution"],
+        latency_mean=options["latency_mean"],
+        latency_spread=options["latency_spread"],
+        output_chars=tuple(options["output_chars"]),
+        seed=options["seed"],
+    ))
+    generator = DatasetGenerator(max_concurrency=concurrency, client=GeminiClient(backend=backend))
+    if path == "http":
+        # Import the API (and its dependencies) before the clock starts; _run_path only reuses the modules
+        import httpx  # noqa: F401
+        from src.api import main  # noqa: F401
+
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        samples = asyncio.run(_run_path(path, generator, options["samples"], options["num_turns"], workdir))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "path": path,
+        "concurrency": concurrency,
+        "samples": samples,
+        "calls": len(backend.latencies),
+        "seconds": round(elapsed, 4),
+        "samples_per_sec": round(samples / elapsed, 2) if elapsed else 0.0,
+        "p50_latency": round(percentile(backend.latencies, 0.50), 4),
+        "p99_latency": round(percentile(backend.latencies, 0.99), 4),
+        # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1
+        ),
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], max_regression: float) -> List[str]:
+    previous = {(entry["path"], entry["concurrency"]): entry for entry in baseline}
+    failures = []
+    for entry in results:
+        before = previous.get((entry["path"], entry["concurrency"]))
+        if before is None or not before["samples_per_sec"]:
+            continue
+        change = entry["samples_per_sec"] / before["samples_per_sec"] - 1
+        if change < -max_regression:
+            failures.append(
+                f"{entry['path']} @ concurrency {entry['concurrency']}: "
+                f"{before['samples_per_sec']} -> {entry['samples_per_sec']} samples/sec ({change:+.1%})"
+            )
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paths", default=",".join(PATHS))
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--num-turns", type=int, default=3)
+    parser.add_argument("--latency-distribution", default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=0.05)
+    parser.add_argument("--latency-spread", type=float, default=0.5)
+    parser.add_argument("--output-chars", default="200-800")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against results previously written with --output")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    low, _, high = args.output_chars.partition("-")
+    options = {
+        "samples": args.samples,
+        "num_turns": args.num_turns,
+        "latency_distribution": args.latency_distribution,
+        "latency_mean": args.latency_mean,
+        "latency_spread": args.latency_spread,
+        "output_chars": (int(low), int(high or low)),
+        "seed": args.seed,
+    }
+    paths = [path for path in args.paths.split(",") if path]
+    for path in paths:
+        if path not in PATHS:
+            parser.error(f"Unknown path: {path}")
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    print(f"{'path':<8}{'conc':>6}{'samples/s':>12}{'p50 (s)':>10}{'p99 (s)':>10}{'rss (MB)':>10}")
+    for path in paths:
+        for concurrency in (int(value) for value in args.concurrency.split(",")):
+            with context.Pool(1) as pool:
+                result = pool.apply(run_case, (path, concurrency, options))
+            results.append(result)
+            print(
+                f"{path:<8}{concurrency:>6}{result['samples_per_sec']:>12}{result['p50_latency']:>10}"
+                f"{result['p99_latency']:>10}{result['peak_rss_mb']:>10}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(results, json.load(f), args.max_regression)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
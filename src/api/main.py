@@ -1,28 +1,66 @@
-import os
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
-from pydantic import BaseModel, Field
-from typing import Literal, Optional
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, Response
+from pydantic import BaseModel, Field, model_validator
+from starlette.background import BackgroundTask
+from typing import AsyncGenerator, Literal, Optional
+from functools import partial
 import json
-import re
+from src import metrics
+from src.backends import GEMINI_JSON_MODELS
+from src.config import Config
 from src.generator import DatasetGenerator
-from io import StringIO
+from src.jobs import JobManager, JobStore
+from src.writer import ShardedDatasetWriter
+import shutil
 import tempfile
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+COMPRESSED_MEDIA_TYPES = {"gzip": "application/gzip", "zstd": "application/zstd"}
+
+generator: Optional[DatasetGenerator] = None
+job_manager: Optional[JobManager] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients are created here rather than at import, so each server worker process
+    # builds its own after it starts and importing the app needs no credentials
+    global generator, job_manager
+    owns_generator = generator is None
+    if owns_generator:
+        generator = DatasetGenerator()
+    await generator.client.warm_up()
+    store = JobStore(Config.JOB_DB_PATH)
+    job_manager = JobManager(generator, store)
+    await job_manager.start()
+    try:
+        yield
+    finally:
+        await job_manager.stop()
+        store.close()
+        job_manager = None
+        if owns_generator:
+            generator = None
+
 app = FastAPI(
     title="Dataset Generator API",
     description="API for generating multi-turn conversational datasets",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
-generator = DatasetGenerator()
+def _check_structured_model(request):
+    # Every structured call would fail upstream, so reject the request up front (422)
+    if request.mode == "structured" and request.model not in GEMINI_JSON_MODELS:
+        raise ValueError(
+            f"mode 'structured' needs a model with JSON output ({', '.join(GEMINI_JSON_MODELS)}), not {request.model}"
+        )
+    return request
 
 class MultiTurnRequest(BaseModel):
     prompt: str
@@ -31,84 +69,161 @@ class MultiTurnRequest(BaseModel):
     fine_tuning_format: bool = False
     output_file: Optional[str] = None
     num_conversations: int = Field(gt=0, default=1)
+    stream_format: Literal["ndjson", "sse"] = "ndjson"
+    ordered: bool = False
+    compression: Literal["none", "gzip", "zstd"] = "none"
+    mode: Literal["text", "structured"] = "text"
+
+    _check_model = model_validator(mode="after")(_check_structured_model)
+
+class JobRequest(BaseModel):
+    prompt: str
+    num_turns: int = Field(gt=0)
+    model: Literal["gemini-pro", "gemini-1.5-pro", "gemini-1.5-flash"] = "gemini-pro"
+    num_conversations: int = Field(gt=0, default=1)
+    mode: Literal["text", "structured"] = "text"
+
+    _check_model = model_validator(mode="after")(_check_structured_model)
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Dataset Generator API"}
 
-@app.post("/generate/multi-turn")
-async def generate_multi_turn(request: MultiTurnRequest):
-    async def generate():
-        for conversation_index in range(request.num_conversations):
+async def _generate_conversation_line(request: MultiTurnRequest, conversation_index: int) -> str:
+    try:
+        formatted_data = await generator.generate_dialogue(
+            request.prompt, request.num_turns, request.model, conversation_index, request.mode
+        )
+        return json.dumps(formatted_data) + "\n"
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Error during generation of conversation {conversation_index + 1}: {str(e)}")
+        return json.dumps({"error": f"Error in conversation {conversation_index + 1}: {str(e)}"}) + "\n"
+
+async def generate_conversation_lines(request: MultiTurnRequest) -> AsyncGenerator[str, None]:
+    """
+    Yield one NDJSON line per conversation. Conversations are generated concurrently
+    under the generator's scheduler and yielded as they finish (or in index order when
+    ``request.ordered`` is set).
+    """
+    conversations = (
+        partial(_generate_conversation_line, request, conversation_index)
+        for conversation_index in range(request.num_conversations)
+    )
+    async for _, _, line in generator.scheduler.run([conversations], ordered=request.ordered):
+        yield line
+
+async def _stream_until_disconnect(
+    http_request: Request, chunks: AsyncGenerator[str, None], poll_interval: float = 1.0
+) -> AsyncGenerator[str, None]:
+    """
+    Relay ``chunks`` to the client, closing the underlying generator (and with it every
+    in-flight model call) as soon as the client goes away.
+
+    The next chunk is only requested once the previous one has been handed to the
+    server, so a slow client throttles generation instead of growing a buffer.
+    """
+    next_chunk = asyncio.ensure_future(chunks.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_chunk}, timeout=poll_interval)
+            if not done:
+                if await http_request.is_disconnected():
+                    logger.info("Client disconnected, cancelling generation")
+                    break
+                continue
             try:
-                full_prompt = f"""Generate a {request.num_turns}-turn dialogue about the following topic. 
-                Each turn should start with either 'Human:' or 'AI:' and contain a complete thought or question.
-                Topic: {request.prompt}
-                
-                Human: {request.prompt}"""
-                
-                logger.debug(f"Full prompt for conversation {conversation_index + 1}: {full_prompt}")
-                
-                full_dialogue = await generator._generate_content(full_prompt, request.model)
-                logger.debug(f"Generated dialogue for conversation {conversation_index + 1}: {full_dialogue}")
-
-                turns = re.split(r'(Human:|AI:)\s*', full_dialogue)
-                turns = [turn.strip() for turn in turns if turn.strip()]
-                logger.debug(f"Parsed turns for conversation {conversation_index + 1}: {turns}")
-
-                conversation = []
-                for i in range(0, len(turns) - 1, 2):
-                    speaker = turns[i]
-                    content = turns[i + 1]
-
-                    if speaker == "Human:":
-                        turn_data = {"input": {"content": content}}
-                    elif speaker == "AI:":
-                        turn_data = {"output": {"content": content}}
-                    else:
-                        logger.warning(f"Unexpected speaker in conversation {conversation_index + 1}: {speaker}")
-                        continue
-
-                    conversation.append(turn_data)
-
-                try:
-                    formatted_data = generator._format_for_fine_tuning({
-                        "conversation": conversation,
-                        "metadata": {
-                            "num_turns": request.num_turns,
-                            "model": request.model,
-                            "conversation_index": conversation_index
-                        }
-                    })
-                    yield json.dumps(formatted_data) + "\n"
-                except Exception as e:
-                    logger.error(f"Error in _format_for_fine_tuning for conversation {conversation_index + 1}: {str(e)}")
-                    logger.error(f"Conversation data: {conversation}")
-                    yield json.dumps({"error": f"Error in formatting conversation {conversation_index + 1}: {str(e)}"}) + "\n"
-            except Exception as e:
-                logger.error(f"Error during generation of conversation {conversation_index + 1}: {str(e)}")
-                yield json.dumps({"error": f"Error in conversation {conversation_index + 1}: {str(e)}"}) + "\n"
-
-    content = StringIO()
-    async for chunk in generate():
-        content.write(chunk)
-    
-    content.seek(0)
-    
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                break
+            yield chunk
+            next_chunk = asyncio.ensure_future(chunks.__anext__())
+    finally:
+        if not next_chunk.done():
+            next_chunk.cancel()
+            await asyncio.gather(next_chunk, return_exceptions=True)
+        await chunks.aclose()
+
+async def _to_sse(lines: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+    async for line in lines:
+        yield f"data: {line.rstrip()}\n\n"
+    yield "event: end\ndata: {}\n\n"
+
+@app.post("/generate/multi-turn")
+async def generate_multi_turn(request: MultiTurnRequest, http_request: Request):
+    lines = generate_conversation_lines(request)
+
     if request.output_file:
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.jsonl') as temp_file:
-            temp_file.write(content.getvalue())
-            temp_file_path = temp_file.name
+        # Stream straight to a single (optionally compressed) shard, then return it as a download
+        temp_dir = tempfile.mkdtemp()
+        try:
+            async with ShardedDatasetWriter(temp_dir, compression=request.compression) as writer:
+                async for line in lines:
+                    await writer.write(line)
+        except BaseException:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
 
-        # Return the file as a downloadable response
         return FileResponse(
-            temp_file_path,
-            media_type="application/json",
-            filename=request.output_file
+            writer.paths[0],
+            media_type=COMPRESSED_MEDIA_TYPES.get(request.compression, "application/json"),
+            filename=request.output_file,
+            background=BackgroundTask(shutil.rmtree, temp_dir, ignore_errors=True)
         )
-    else:
-        return StreamingResponse(content, media_type="application/json")
+
+    chunks = _stream_until_disconnect(http_request, lines)
+    if request.stream_format == "sse":
+        return StreamingResponse(_to_sse(chunks), media_type="text/event-stream")
+    return StreamingResponse(chunks, media_type="application/x-ndjson")
+
+@app.get("/metrics")
+async def get_metrics():
+    # Point-in-time values are sampled at scrape time rather than tracked on the hot path
+    for stat, value in generator.client.cache_stats().items():
+        metrics.CACHE.set(value, stat)
+    if job_manager is not None:
+        metrics.JOBS_QUEUED.set(job_manager.queue_depth())
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: JobRequest):
+    job_id = await job_manager.submit(request.model_dump())
+    return {"id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    status = await job_manager.get_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return status
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(
+    job_id: str, offset: int = Query(0, ge=0), limit: int = Query(100, gt=0, le=10000)
+):
+    """
+    Stream finished records of a job as NDJSON, starting at ``offset`` in completion
+    order. The ``X-Next-Offset`` header holds the offset to pass for the next page.
+    """
+    job = await asyncio.to_thread(job_manager.store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    end = min(offset + limit, job["completed"])
+    page_size = 500
+
+    async def records():
+        for page_offset in range(offset, end, page_size):
+            page = await asyncio.to_thread(
+                job_manager.store.get_results, job_id, page_offset, min(page_size, end - page_offset)
+            )
+            yield "".join(record + "\n" for record in page)
+
+    return StreamingResponse(
+        records(),
+        media_type="application/x-ndjson",
+        headers={"X-Next-Offset": str(max(end, offset)), "X-Job-Status": job["status"]}
+    )
 
 @app.exception_handler(404)
 async def custom_404_handler(request, exc):
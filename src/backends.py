@@ -0,0 +1,354 @@
+import os
+import json
+import math
+import random
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional, Sequence
+from src.config import Config
+
+GEMINI_MODELS = ("gemini-pro", "gemini-1.5-pro", "gemini-1.5-flash")
+# Models with a JSON output mode (response_schema); gemini-pro rejects it with a 400
+GEMINI_JSON_MODELS = ("gemini-1.5-pro", "gemini-1.5-flash")
+LATENCY_DISTRIBUTIONS = ("constant", "uniform", "exponential", "lognormal")
+# Fields the Gemini SDK accepts in a response schema; anything else (e.g. JSON Schema's
+# camelCase ``minItems``) makes it raise before the request is sent
+SCHEMA_FIELDS = (
+    "type", "format", "description", "nullable", "enum", "properties", "required", "items", "min_items", "max_items"
+)
+
+
+class ModelResponse:
+    def __init__(
+        self, text: str, prompt_tokens: Optional[int] = None, output_tokens: Optional[int] = None,
+        candidates: Optional[List[str]] = None
+    ):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        # Every candidate's text when more than one was requested; ``text`` is the first
+        self.candidates = candidates
+
+
+class BackendError(Exception):
+    """
+    Upstream failure normalized across backends. ``status_code`` follows HTTP semantics
+    (429 for rate limits, 5xx for server errors) and ``retry_after`` is in seconds.
+    """
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class ModelBackend:
+    """
+    Interface between ``GeminiClient`` and a model provider.
+
+    ``history`` passed to ``chat`` uses the Gemini content format
+    (``{"role": "user" | "model", "parts": [...]}``). With a ``response_schema`` (a JSON
+    schema), ``generate`` must return JSON that follows it; only models in
+    ``json_models`` accept one. ``candidate_count`` asks for several independent
+    responses at once, up to ``max_candidates(model)``.
+    """
+
+    models: tuple = ()
+    json_models: tuple = ()
+    candidate_limits: Dict[str, int] = {}
+
+    def supports(self, model: str) -> bool:
+        return model in self.models
+
+    def supports_json(self, model: str) -> bool:
+        return model in self.json_models
+
+    def max_candidates(self, model: str) -> int:
+        return self.candidate_limits.get(model, 1)
+
+    async def generate(
+        self, model: str, prompt: str, response_schema: Optional[Dict[str, Any]] = None, candidate_count: int = 1
+    ) -> ModelResponse:
+        raise NotImplementedError
+
+    async def chat(self, model: str, history: List[Dict[str, Any]], message: str) -> ModelResponse:
+        raise NotImplementedError
+
+    async def warm_up(self, models: Sequence[str]):
+        """Prepare whatever the first call to each of ``models`` would otherwise set up."""
+
+
+class GeminiBackend(ModelBackend):
+    models = GEMINI_MODELS
+    json_models = GEMINI_JSON_MODELS
+    candidate_limits = {"gemini-1.5-pro": 8, "gemini-1.5-flash": 8}
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key or os.getenv("API_KEY")
+        if not self.api_key:
+            raise ValueError("API_KEY not found in environment variables")
+        self._genai = None
+        self._models: Dict[str, Any] = {}
+
+    def _model(self, model: str):
+        # google.generativeai takes about a second to import, so the SDK is loaded (and
+        # each model built) on first use rather than when the backend is created
+        generative_model = self._models.get(model)
+        if generative_model is None:
+            if self._genai is None:
+                import google.generativeai as genai
+
+                genai.configure(api_key=self.api_key)
+                self._genai = genai
+            generative_model = self._models[model] = self._genai.GenerativeModel(model)
+        return generative_model
+
+    async def warm_up(self, models: Sequence[str]):
+        for model in models:
+            await asyncio.to_thread(self._model, model)
+
+    @staticmethod
+    def _to_response(response) -> ModelResponse:
+        usage = getattr(response, "usage_metadata", None)
+        candidates = None
+        if len(response.candidates) > 1:
+            # ``response.text`` is only available for single-candidate responses
+            candidates = ["".join(part.text for part in candidate.content.parts) for candidate in response.candidates]
+        return ModelResponse(
+            candidates[0] if candidates else response.text,
+            getattr(usage, "prompt_token_count", None),
+            getattr(usage, "candidates_token_count", None),
+            candidates
+        )
+
+    @staticmethod
+    def _to_backend_error(error: Exception) -> Exception:
+        from google.api_core import exceptions as api_exceptions
+
+        if isinstance(error, api_exceptions.GoogleAPICallError):
+            return BackendError(str(error), status_code=error.code, retry_after=GeminiBackend._retry_delay(error))
+        return error
+
+    @staticmethod
+    def _retry_delay(error) -> Optional[float]:
+        # gRPC errors carry RetryInfo messages, REST errors their JSON form ({"retryDelay": "27s"})
+        for detail in getattr(error, "details", None) or ():
+            if isinstance(detail, dict):
+                if detail.get("@type", "").endswith("google.rpc.RetryInfo") and detail.get("retryDelay"):
+                    return float(str(detail["retryDelay"]).rstrip("s"))
+            elif getattr(getattr(detail, "DESCRIPTOR", None), "full_name", None) == "google.rpc.RetryInfo":
+                return detail.retry_delay.seconds + detail.retry_delay.nanos / 1e9
+        return None
+
+    async def generate(
+        self, model: str, prompt: str, response_schema: Optional[Dict[str, Any]] = None, candidate_count: int = 1
+    ) -> ModelResponse:
+        generation_config = {}
+        if response_schema is not None:
+            generation_config.update(response_mime_type="application/json", response_schema=response_schema)
+        if candidate_count > 1:
+            generation_config["candidate_count"] = candidate_count
+        generation_config = generation_config or None
+        try:
+            response = await self._model(model).generate_content_async(prompt, generation_config=generation_config)
+        except Exception as e:
+            raise self._to_backend_error(e) from e
+        return self._to_response(response)
+
+    async def chat(self, model: str, history: List[Dict[str, Any]], message: str) -> ModelResponse:
+        try:
+            chat = self._model(model).start_chat(history=history)
+            response = await chat.send_message_async(message)
+        except Exception as e:
+            raise self._to_backend_error(e) from e
+        return self._to_response(response)
+
+
+_WORDS = (
+    "the model data answer question idea system people time work example because could "
+    "think about would really interesting point make sense different important maybe "
+    "learn language conversation another reason simple perhaps course right world"
+).split()
+
+
+class SimulatedBackend(ModelBackend):
+    """
+    Deterministic local stand-in for a model provider, for load tests and benchmarks.
+
+    Latency is drawn from ``latency_distribution`` (``constant``, ``uniform``,
+    ``exponential`` or ``lognormal``) around ``latency_mean`` seconds; ``latency_spread``
+    is the half-width for ``uniform`` and sigma for ``lognormal``. A call fails with a
+    429 with probability ``rate_limit_rate`` and with a 503 with probability
+    ``error_rate``. Output length in characters is drawn uniformly from
+    ``output_chars``. Calls with a ``response_schema`` get JSON following the schema
+    (schemas with fields the Gemini SDK rejects raise the same ``ValueError``, and
+    models without a JSON mode, such as ``gemini-pro``, fail with a 400), truncated
+    into invalid JSON with probability ``malformed_rate``. Up to
+    ``max_candidates`` candidates can be requested per call. Every draw is seeded from ``seed``, the request content and how
+    often that request was seen, so reruns are reproducible regardless of scheduling.
+    """
+
+    models = GEMINI_MODELS
+    json_models = GEMINI_JSON_MODELS
+
+    def __init__(
+        self, latency_distribution: str = "lognormal", latency_mean: float = 0.5, latency_spread: float = 0.5,
+        error_rate: float = 0.0, rate_limit_rate: float = 0.0, output_chars: tuple = (200, 800),
+        seed: int = 0, models: Optional[tuple] = None, malformed_rate: float = 0.0, max_candidates: int = 8
+    ):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Invalid latency distribution: {latency_distribution}")
+        self.latency_distribution = latency_distribution
+        self.latency_mean = latency_mean
+        self.latency_spread = latency_spread
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.output_chars = output_chars
+        self.seed = seed
+        self.malformed_rate = malformed_rate
+        if models is not None:
+            self.models = tuple(models)
+            # Made-up model names get a JSON mode; Gemini ones behave like the real models
+            self.json_models = tuple(
+                model for model in self.models if model not in GEMINI_MODELS or model in GEMINI_JSON_MODELS
+            )
+        # max_candidates applies where Gemini allows several candidates at all (not gemini-pro)
+        self.candidate_limits = {
+            model: max_candidates if model not in GEMINI_MODELS or model in GeminiBackend.candidate_limits else 1
+            for model in self.models
+        }
+        self._seen: Dict[str, int] = {}
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls) -> "SimulatedBackend":
+        low, _, high = os.getenv("SIMULATOR_OUTPUT_CHARS", "200-800").partition("-")
+        return cls(
+            latency_distribution=os.getenv("SIMULATOR_LATENCY_DISTRIBUTION", "lognormal"),
+            latency_mean=float(os.getenv("SIMULATOR_LATENCY_MEAN", 0.5)),
+            latency_spread=float(os.getenv("SIMULATOR_LATENCY_SPREAD", 0.5)),
+            error_rate=float(os.getenv("SIMULATOR_ERROR_RATE", 0.0)),
+            rate_limit_rate=float(os.getenv("SIMULATOR_RATE_LIMIT_RATE", 0.0)),
+            output_chars=(int(low), int(high or low)),
+            seed=int(os.getenv("SIMULATOR_SEED", 0)),
+            malformed_rate=float(os.getenv("SIMULATOR_MALFORMED_RATE", 0.0)),
+            max_candidates=int(os.getenv("SIMULATOR_MAX_CANDIDATES", 8)),
+        )
+
+    def _rng(self, model: str, content: str) -> random.Random:
+        digest = hashlib.sha256(f"{self.seed}\0{model}\0{content}".encode("utf-8")).hexdigest()
+        occurrence = self._seen.get(digest, 0)
+        self._seen[digest] = occurrence + 1
+        return random.Random(f"{digest}:{occurrence}")
+
+    def _latency(self, rng: random.Random) -> float:
+        if self.latency_distribution == "constant":
+            return self.latency_mean
+        if self.latency_distribution == "uniform":
+            return max(0.0, rng.uniform(self.latency_mean - self.latency_spread, self.latency_mean + self.latency_spread))
+        if self.latency_distribution == "exponential":
+            return rng.expovariate(1 / self.latency_mean) if self.latency_mean > 0 else 0.0
+        if self.latency_mean <= 0:
+            return 0.0
+        # lognormal parametrized so that its mean equals latency_mean
+        mu = math.log(self.latency_mean) - self.latency_spread ** 2 / 2
+        return rng.lognormvariate(mu, self.latency_spread)
+
+    @staticmethod
+    def _words(rng: random.Random, target: int) -> List[str]:
+        words = []
+        length = 0
+        while length < target:
+            word = rng.choice(_WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return words
+
+    def _text(self, rng: random.Random, prompt: str) -> str:
+        words = self._words(rng, rng.randint(*self.output_chars))
+        text = " ".join(words)
+        if "'Human:' or 'AI:'" in prompt:
+            # Mimic the dialogue layout the single-call generation path asks for
+            half = len(words) // 2
+            text = f"Human: {' '.join(words[:half])}\nAI: {' '.join(words[half:])}"
+        return text
+
+    @classmethod
+    def _check_schema(cls, schema: Dict[str, Any]):
+        for field, value in schema.items():
+            if field not in SCHEMA_FIELDS:
+                raise ValueError(f"Unknown field for Schema: {field}")
+        for value in schema.get("properties", {}).values():
+            cls._check_schema(value)
+        if "items" in schema:
+            cls._check_schema(schema["items"])
+
+    def _json_value(self, rng: random.Random, schema: Dict[str, Any], chars: int) -> Any:
+        kind = schema.get("type")
+        if kind == "object":
+            properties = schema.get("properties", {})
+            return {name: self._json_value(rng, value, chars // max(len(properties), 1))
+                    for name, value in properties.items()}
+        if kind == "array":
+            count = schema.get("min_items", 1)
+            return [self._json_value(rng, schema.get("items", {}), chars // max(count, 1)) for _ in range(count)]
+        if kind in ("integer", "number"):
+            return rng.randint(0, 100)
+        if kind == "boolean":
+            return rng.random() < 0.5
+        if "enum" in schema:
+            return rng.choice(schema["enum"])
+        return " ".join(self._words(rng, max(chars, 1)))
+
+    async def _respond(
+        self, model: str, content: str, prompt_chars: int, response_schema: Optional[Dict[str, Any]] = None,
+        candidate_count: int = 1
+    ) -> ModelResponse:
+        if response_schema is not None:
+            self._check_schema(response_schema)
+        self.calls += 1
+        rng = self._rng(model, content)
+        await asyncio.sleep(self._latency(rng))
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            raise BackendError("Simulated rate limit exceeded", status_code=429, retry_after=1.0)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise BackendError("Simulated upstream error", status_code=503)
+        if response_schema is not None and not self.supports_json(model):
+            raise BackendError(f"{model} does not support JSON output", status_code=400)
+        if candidate_count > self.max_candidates(model):
+            raise BackendError(f"{model} supports at most {self.max_candidates(model)} candidates", status_code=400)
+        texts = []
+        for _ in range(candidate_count):
+            if response_schema is None:
+                text = self._text(rng, content)
+            else:
+                text = json.dumps(self._json_value(rng, response_schema, rng.randint(*self.output_chars)))
+                if rng.random() < self.malformed_rate:
+                    text = text[:len(text) // 2]
+            texts.append(text)
+        return ModelResponse(
+            texts[0], prompt_tokens=(prompt_chars + 3) // 4, output_tokens=sum((len(text) + 3) // 4 for text in texts),
+            candidates=texts if candidate_count > 1 else None
+        )
+
+    async def generate(
+        self, model: str, prompt: str, response_schema: Optional[Dict[str, Any]] = None, candidate_count: int = 1
+    ) -> ModelResponse:
+        return await self._respond(model, prompt, len(prompt), response_schema, candidate_count)
+
+    async def chat(self, model: str, history: List[Dict[str, Any]], message: str) -> ModelResponse:
+        history_text = "\n".join(
+            f"{entry.get('role')}: {''.join(str(part) for part in entry.get('parts', []))}" for entry in history
+        )
+        content = f"{history_text}\n{message}"
+        return await self._respond(model, content, len(content))
+
+
+def create_backend(name: Optional[str] = None) -> ModelBackend:
+    name = name or Config.MODEL_BACKEND
+    if name == "gemini":
+        return GeminiBackend()
+    if name == "simulator":
+        return SimulatedBackend.from_env()
+    raise ValueError(f"Invalid model backend: {name}")
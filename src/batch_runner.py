@@ -0,0 +1,556 @@
+"""
+Run a large batch across worker processes, and across machines sharing a filesystem.
+
+The requests file holds one batch request per line (``prompt``, ``num_samples`` and
+optionally ``num_turns``, ``mode`` and ``context``, as for ``generate_batch_dataset``):
+
+    python -m src.batch_runner run batch_requests.jsonl --run-dir output/run --model gemini-1.5-flash \\
+        --workers 4 --output output/batch_output.json
+
+or step by step, with ``work`` started on as many machines as you like:
+
+    python -m src.batch_runner enqueue batch_requests.jsonl --run-dir output/run --model gemini-1.5-flash
+    python -m src.batch_runner work --run-dir output/run --workers 4
+    python -m src.batch_runner status --run-dir output/run
+    python -m src.batch_runner merge --run-dir output/run --output output/batch_output.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import signal
+import socket
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from src.checkpoint import scan_instance_log, write_batch_output
+from src.generator import DatasetGenerator
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY,
+    spec TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    request_id INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    stop INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    heartbeat REAL NOT NULL,
+    stopped_at REAL
+);
+"""
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+def queue_path(run_dir: str) -> str:
+    return os.path.join(run_dir, "queue.db")
+
+
+def shard_dir(run_dir: str) -> str:
+    return os.path.join(run_dir, "shards")
+
+
+def read_requests(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream batch request specs from a JSONL file, validating each line."""
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            spec = DatasetGenerator._batch_request_spec(request)
+            if not isinstance(spec["prompt"], str) or not isinstance(spec["num_samples"], int) \
+                    or spec["num_samples"] < 0:
+                raise ValueError(f"{path}:{line_number}: a request needs a prompt and a non-negative num_samples")
+            yield spec
+
+
+class WorkQueue:
+    """
+    SQLite work queue of batch tasks, each a range of samples of one request.
+
+    Workers lease tasks and renew their leases while generating; a task whose lease
+    expires (its worker crashed or its machine went away) is handed out again. A task
+    that fails ``max_attempts`` times is marked failed. The database keeps the default
+    rollback journal instead of WAL so that it works on a shared filesystem with POSIX
+    locks, and lease times are wall-clock times, so machines need synchronised clocks.
+
+    All methods are blocking; workers call them through ``asyncio.to_thread``.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 120.0, max_attempts: int = 3):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never lease the same task
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def settings(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT name, value FROM settings").fetchall()
+        return {row["name"]: json.loads(row["value"]) for row in rows}
+
+    def enqueue(
+        self, specs: Iterable[Dict[str, Any]], model: str, fine_tuning_format: bool, chunk_size: int = 16
+    ) -> int:
+        """
+        Split the requests into tasks of up to ``chunk_size`` samples and return the
+        number of requests. Enqueueing the same batch again is a no-op, so every machine
+        may run ``enqueue``; a different batch is rejected.
+        """
+        fingerprint = hashlib.sha256(json.dumps([model, fine_tuning_format, chunk_size]).encode("utf-8"))
+        with self._transaction() as conn:
+            initialized = conn.execute("SELECT 1 FROM settings WHERE name = 'fingerprint'").fetchone() is not None
+            count = 0
+            for spec in specs:
+                encoded = json.dumps(spec, sort_keys=True)
+                fingerprint.update(encoded.encode("utf-8"))
+                if not initialized:
+                    conn.execute("INSERT INTO requests (id, spec) VALUES (?, ?)", (count, encoded))
+                    conn.executemany(
+                        "INSERT INTO tasks (request_id, start, stop, status) VALUES (?, ?, ?, ?)",
+                        (
+                            (count, start, min(start + chunk_size, spec["num_samples"]), PENDING)
+                            for start in range(0, spec["num_samples"], chunk_size)
+                        )
+                    )
+                count += 1
+            if initialized:
+                stored = conn.execute("SELECT value FROM settings WHERE name = 'fingerprint'").fetchone()["value"]
+                if json.loads(stored) != fingerprint.hexdigest():
+                    raise ValueError("The run directory holds a different batch; use another --run-dir")
+                return count
+            conn.executemany("INSERT INTO settings (name, value) VALUES (?, ?)", (
+                (name, json.dumps(value)) for name, value in {
+                    "model": model,
+                    "fine_tuning_format": fine_tuning_format,
+                    "chunk_size": chunk_size,
+                    "fingerprint": fingerprint.hexdigest(),
+                }.items()
+            ))
+        return count
+
+    def requests(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, spec FROM requests ORDER BY id").fetchall()
+        for row in rows:
+            yield row["id"], json.loads(row["spec"])
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Lease the next pending task, or a task whose lease expired; ``None`` when there is none."""
+        with self._transaction() as conn:
+            while True:
+                now = time.time()
+                row = conn.execute(
+                    "SELECT id, attempts FROM tasks WHERE status = ? ORDER BY id LIMIT 1", (PENDING,)
+                ).fetchone() or conn.execute(
+                    "SELECT id, attempts FROM tasks WHERE status = ? AND lease_expires < ? ORDER BY id LIMIT 1",
+                    (LEASED, now)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row["attempts"] >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE tasks SET status = ?, owner = NULL, lease_expires = NULL, error = ? WHERE id = ?",
+                        (FAILED, "Lease expired too many times", row["id"])
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE tasks SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                    (LEASED, worker_id, now + self.lease_seconds, row["id"])
+                )
+                task = conn.execute(
+                    "SELECT tasks.id, request_id, start, stop, attempts, spec FROM tasks "
+                    "JOIN requests ON requests.id = tasks.request_id WHERE tasks.id = ?", (row["id"],)
+                ).fetchone()
+                return dict(task, spec=json.loads(task["spec"]))
+
+    def renew(self, worker_id: str):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE owner = ? AND status = ?",
+                (now + self.lease_seconds, worker_id, LEASED)
+            )
+            conn.execute("UPDATE workers SET heartbeat = ? WHERE id = ?", (now, worker_id))
+
+    def complete(self, task_id: int, worker_id: str) -> bool:
+        """Mark a task done; ``False`` if its lease was lost to another worker in the meantime."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = ?, lease_expires = NULL WHERE id = ? AND owner = ? AND status = ?",
+                (DONE, task_id, worker_id, LEASED)
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, task_id: int, worker_id: str, error: str):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, owner = NULL, "
+                "lease_expires = NULL, error = ? WHERE id = ? AND owner = ? AND status = ?",
+                (self.max_attempts, FAILED, PENDING, error, task_id, worker_id, LEASED)
+            )
+
+    def release(self, worker_id: str):
+        """Return the tasks leased by a worker that is leaving to the queue."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = ?, owner = NULL, lease_expires = NULL, attempts = attempts - 1 "
+                "WHERE owner = ? AND status = ?",
+                (PENDING, worker_id, LEASED)
+            )
+
+    def register_worker(self, worker_id: str):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO workers (id, host, pid, started_at, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                (worker_id, socket.gethostname(), os.getpid(), now, now)
+            )
+
+    def stop_worker(self, worker_id: str):
+        with self._transaction() as conn:
+            conn.execute("UPDATE workers SET stopped_at = ? WHERE id = ?", (time.time(), worker_id))
+
+    def remaining(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)", (PENDING, LEASED)
+            ).fetchone()[0]
+
+    def progress(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS tasks, SUM(stop - start) AS samples FROM tasks GROUP BY status"
+            ).fetchall()
+            workers = self._conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE stopped_at IS NULL AND heartbeat >= ?",
+                (time.time() - self.lease_seconds,)
+            ).fetchone()[0]
+            errors = [row["error"] for row in self._conn.execute(
+                "SELECT DISTINCT error FROM tasks WHERE status = ? LIMIT 5", (FAILED,)
+            ).fetchall()]
+        progress = {
+            "tasks": {row["status"]: row["tasks"] for row in rows},
+            "samples": {row["status"]: row["samples"] for row in rows},
+            "active_workers": workers,
+        }
+        if errors:
+            progress["errors"] = errors
+        return progress
+
+
+class BatchWorker:
+    """
+    Generate leased tasks on one event loop and append the instances to this worker's
+    own shard, ``shards/<worker id>.jsonl``, in the ``BatchCheckpoint`` log format.
+
+    A task is marked done only after its instances are synced to the shard. Samples of a
+    task that is released or lost (e.g. the worker is stopped) may therefore appear in
+    more than one shard; ``merge`` keeps one copy of each.
+    """
+
+    def __init__(
+        self, run_dir: str, max_concurrency: Optional[int] = None, lease_seconds: float = 120.0,
+        max_attempts: int = 3, poll_interval: float = 2.0, generator: Optional[DatasetGenerator] = None
+    ):
+        self.run_dir = run_dir
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.max_concurrency = max_concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.generator = generator
+        self.samples_written = 0
+        self._queue: Optional[WorkQueue] = None
+        self._shard = None
+        # Samples still missing per lease, keyed by (task id, attempt) so a retried task is a new lease
+        self._pending: Dict[Tuple[int, int], int] = {}
+        self._progress = asyncio.Event()
+
+    @staticmethod
+    async def _generate_sample(
+        generator: DatasetGenerator, spec: Dict[str, Any], sample_id: int, model: str, fine_tuning_format: bool
+    ) -> Tuple[int, Optional[Dict[str, Any]], Optional[str]]:
+        try:
+            _, instance = await generator._generate_batch_instance(spec, sample_id, model, fine_tuning_format)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return sample_id, None, str(e)
+        return sample_id, instance, None
+
+    def _sync_shard(self):
+        self._shard.flush()
+        os.fsync(self._shard.fileno())
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await asyncio.to_thread(self._queue.renew, self.worker_id)
+
+    async def _run_task(self, generator: DatasetGenerator, task: Dict[str, Any], model: str, fine_tuning_format: bool):
+        lease = (task["id"], task["attempts"])
+        samples = (
+            partial(self._generate_sample, generator, task["spec"], sample_id, model, fine_tuning_format)
+            for sample_id in range(task["start"], task["stop"])
+        )
+        try:
+            # Tasks share the generator's scheduler, and with it the concurrency cap
+            async for _, _, (sample_id, instance, error) in generator.scheduler.run([samples]):
+                if error is not None:
+                    logger.error(f"Task {task['id']} failed at sample {sample_id}: {error}")
+                    await asyncio.to_thread(self._queue.fail, task["id"], self.worker_id, error)
+                    return
+                self._shard.write(json.dumps({
+                    "request_id": task["request_id"],
+                    "sample_id": sample_id,
+                    "instance": instance,
+                }) + "\n")
+                self.samples_written += 1
+                self._pending[lease] -= 1
+                self._progress.set()
+        finally:
+            del self._pending[lease]
+            self._progress.set()
+        await asyncio.to_thread(self._sync_shard)
+        if not await asyncio.to_thread(self._queue.complete, task["id"], self.worker_id):
+            logger.warning(f"Lease on task {task['id']} was lost; another worker generates it again")
+
+    async def _drain(self, generator: DatasetGenerator, model: str, fine_tuning_format: bool):
+        # Lease a new task only while fewer samples are outstanding than the worker can run
+        # at once, so other workers still find tasks to claim. Claims run off the event loop:
+        # they may wait on SQLite's write lock.
+        runs = set()
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and sum(self._pending.values()) < generator.scheduler.max_concurrency:
+                    task = await asyncio.to_thread(self._queue.claim, self.worker_id)
+                    if task is None:
+                        exhausted = True
+                        break
+                    self._pending[(task["id"], task["attempts"])] = task["stop"] - task["start"]
+                    runs.add(asyncio.create_task(self._run_task(generator, task, model, fine_tuning_format)))
+                if not runs:
+                    return
+                self._progress.clear()
+                progress = asyncio.create_task(self._progress.wait())
+                done, _ = await asyncio.wait(runs | {progress}, return_when=asyncio.FIRST_COMPLETED)
+                progress.cancel()
+                for run in done & runs:
+                    runs.discard(run)
+                    run.result()
+        finally:
+            for run in runs:
+                run.cancel()
+            if runs:
+                await asyncio.gather(*runs, return_exceptions=True)
+
+    async def run(self) -> int:
+        """Work until no task is pending or leased, and return the number of samples written."""
+        self._queue = WorkQueue(queue_path(self.run_dir), self.lease_seconds, self.max_attempts)
+        settings = await asyncio.to_thread(self._queue.settings)
+        if "fingerprint" not in settings:
+            raise ValueError(f"No batch enqueued in {self.run_dir}")
+        generator = self.generator or DatasetGenerator(max_concurrency=self.max_concurrency)
+        os.makedirs(shard_dir(self.run_dir), exist_ok=True)
+        self._shard = open(os.path.join(shard_dir(self.run_dir), f"{self.worker_id}.jsonl"), "a")
+        await asyncio.to_thread(self._queue.register_worker, self.worker_id)
+        logger.info(f"Worker {self.worker_id} joined")
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while True:
+                await self._drain(generator, settings["model"], settings["fine_tuning_format"])
+                if not await asyncio.to_thread(self._queue.remaining):
+                    break
+                # Other workers hold the remaining tasks; wait for them to finish or their leases to expire
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            heartbeat.cancel()
+            self._sync_shard()
+            self._shard.close()
+            self._queue.release(self.worker_id)
+            self._queue.stop_worker(self.worker_id)
+            self._queue.close()
+            logger.info(f"Worker {self.worker_id} left after writing {self.samples_written} samples")
+        return self.samples_written
+
+
+def _worker_main(run_dir: str, options: Dict[str, Any]):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(process)d - %(levelname)s - %(message)s")
+
+    async def work():
+        # SIGTERM leaves gracefully like Ctrl-C: leased tasks go back to the queue
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        await BatchWorker(run_dir, **options).run()
+
+    try:
+        asyncio.run(work())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+def run_workers(run_dir: str, num_workers: int, **options) -> int:
+    """Run ``num_workers`` worker processes until the queue is drained; return the number that failed."""
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_worker_main, args=(run_dir, options)) for _ in range(num_workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # The workers got the same SIGINT and release their tasks
+        for process in processes:
+            process.join()
+    return sum(1 for process in processes if process.exitcode)
+
+
+def merge(run_dir: str, output_file: str, allow_partial: bool = False) -> int:
+    """
+    Combine the worker shards into ``output_file`` in the ``batch_output.json`` layout
+    and return the number of instances written. Unless ``allow_partial`` is set, every
+    task must be done.
+    """
+    queue = WorkQueue(queue_path(run_dir))
+    try:
+        settings = queue.settings()
+        if "fingerprint" not in settings:
+            raise ValueError(f"No batch enqueued in {run_dir}")
+        tasks = queue.progress()["tasks"]
+        unfinished = sum(count for status, count in tasks.items() if status != DONE)
+        if unfinished and not allow_partial:
+            raise RuntimeError(f"{unfinished} tasks are not done: {tasks}")
+        specs = list(queue.requests())
+    finally:
+        queue.close()
+
+    locations: Dict[int, Dict[int, Tuple[str, int]]] = {}
+    directory = shard_dir(run_dir)
+    shards = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+    for name in shards:
+        path = os.path.join(directory, name)
+        for request_id, sample_id, offset in scan_instance_log(path):
+            locations.setdefault(request_id, {}).setdefault(sample_id, (path, offset))
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    batch = (
+        {"id": request_id, "model": settings["model"], "metadata": {"num_turns": spec["num_turns"] or 1}}
+        for request_id, spec in specs
+    )
+    write_batch_output(output_file, batch, locations)
+    return sum(len(samples) for samples in locations.values())
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_command(name: str, enqueue: bool = False, work: bool = False, output: bool = False):
+        command = commands.add_parser(name)
+        if enqueue:
+            command.add_argument("requests", help="JSONL file with one batch request per line")
+        command.add_argument("--run-dir", required=True, help="Queue and shard directory, shared by all workers")
+        if enqueue:
+            command.add_argument("--model", default="gemini-1.5-flash")
+            command.add_argument("--fine-tuning-format", action="store_true")
+            command.add_argument("--chunk-size", type=int, default=16, help="Samples per task")
+        if work:
+            command.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+            command.add_argument("--max-concurrency", type=int, help="Concurrent model calls per worker")
+            command.add_argument("--lease-seconds", type=float, default=120.0)
+            command.add_argument("--max-attempts", type=int, default=3)
+        if output:
+            command.add_argument("--output", required=True)
+            command.add_argument("--allow-partial", action="store_true", help="Merge even if some tasks are not done")
+
+    add_command("enqueue", enqueue=True)
+    add_command("work", work=True)
+    add_command("status")
+    add_command("merge", output=True)
+    add_command("run", enqueue=True, work=True, output=True)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    if args.command in ("enqueue", "run"):
+        queue = WorkQueue(queue_path(args.run_dir))
+        try:
+            count = queue.enqueue(read_requests(args.requests), args.model, args.fine_tuning_format, args.chunk_size)
+        finally:
+            queue.close()
+        logger.info(f"Enqueued {count} requests in {args.run_dir}")
+    if args.command in ("work", "run"):
+        failed = run_workers(
+            args.run_dir, args.workers, max_concurrency=args.max_concurrency, lease_seconds=args.lease_seconds,
+            max_attempts=args.max_attempts
+        )
+        if failed:
+            logger.error(f"{failed} workers exited with an error")
+            return 1
+    if args.command == "status":
+        queue = WorkQueue(queue_path(args.run_dir))
+        try:
+            print(json.dumps(queue.progress(), indent=2))
+        finally:
+            queue.close()
+    if args.command in ("merge", "run"):
+        count = merge(args.run_dir, args.output, args.allow_partial)
+        logger.info(f"Merged {count} instances into {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+BYPASS = "bypass"
+READ_ONLY = "read-only"
+READ_WRITE = "read-write"
+CACHE_MODES = (BYPASS, READ_ONLY, READ_WRITE)
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class ResponseCache:
+    """
+    Content-addressed cache for model responses.
+
+    Lookups go through an in-memory LRU first and then an on-disk store of one JSON file
+    per key. The disk store is bounded by ``max_bytes`` (least recently used entries are
+    evicted first) and entries older than ``ttl`` seconds are treated as misses.
+    Concurrent misses for the same key are coalesced into a single upstream call.
+    """
+
+    def __init__(
+        self, directory: str, memory_entries: int = 1024, max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None
+    ):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self._counters = {
+            "memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0,
+            "writes": 0, "evictions": 0, "expired": 0, "bypassed": 0,
+        }
+        os.makedirs(directory, exist_ok=True)
+        # Disk index in LRU order: key -> size in bytes. It is touched from worker
+        # threads, so every access goes through ``_lock``.
+        self._lock = threading.Lock()
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        entries = []
+        for shard in os.scandir(directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def stats(self) -> Dict[str, int]:
+        hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+        return dict(
+            self._counters, hits=hits, memory_entries=len(self._memory),
+            disk_entries=len(self._disk), disk_bytes=self._disk_bytes
+        )
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return self.ttl is not None and time.time() - entry["created_at"] > self.ttl
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key not in self._disk:
+                return None
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._forget_disk(key)
+            return None
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+        return entry
+
+    def _forget_disk(self, key: str):
+        with self._lock:
+            size = self._disk.pop(key, None)
+            if size is None:
+                return
+            self._disk_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _write_disk(self, key: str, entry: Dict[str, Any]):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        evicted = []
+        with self._lock:
+            self._disk_bytes += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._counters["writes"] += 1
+            while self.max_bytes is not None and self._disk_bytes > self.max_bytes and len(self._disk) > 1:
+                oldest, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self._counters["evictions"] += 1
+                evicted.append(oldest)
+        for oldest in evicted:
+            try:
+                os.remove(self._path(oldest))
+            except OSError:
+                pass
+
+    async def _lookup(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            if not self._expired(entry):
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return entry["value"]
+            del self._memory[key]
+        entry = await asyncio.to_thread(self._read_disk, key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            self._counters["expired"] += 1
+            await asyncio.to_thread(self._forget_disk, key)
+            return None
+        self._counters["disk_hits"] += 1
+        self._remember(key, entry)
+        return entry["value"]
+
+    async def _fill(self, key: str, call: Callable[[], Awaitable[str]], mode: str) -> str:
+        value = await call()
+        entry = {"created_at": time.time(), "value": value}
+        if mode == READ_WRITE:
+            self._remember(key, entry)
+            try:
+                await asyncio.to_thread(self._write_disk, key, entry)
+            except OSError as e:
+                logger.warning(f"Failed to write cache entry {key}: {e}")
+        return value
+
+    def _landed(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved; waiters re-raise it themselves
+
+    async def get_or_call(self, key: str, call: Callable[[], Awaitable[str]], mode: str = READ_WRITE) -> str:
+        """
+        Return the cached value for ``key`` or produce it with ``call``.
+
+        ``bypass`` always calls upstream and leaves the cache untouched, ``read-only``
+        serves hits but never stores new values, and ``read-write`` does both.
+        """
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Invalid cache mode: {mode}")
+        if mode == BYPASS:
+            self._counters["bypassed"] += 1
+            return await call()
+
+        value = await self._lookup(key)
+        if value is not None:
+            return value
+
+        flight = self._inflight.get(key)
+        if flight is None:
+            self._counters["misses"] += 1
+            flight = _Flight(asyncio.ensure_future(self._fill(key, call, mode)))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(partial(self._landed, key))
+        else:
+            self._counters["coalesced"] += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            # Only abandon the upstream call once nobody is waiting for it any more
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
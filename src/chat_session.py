@@ -0,0 +1,205 @@
+from typing import Any, Dict, List, Optional, Tuple
+from src.config import Config
+
+CONTEXT_MODES = ("full", "window", "summary")
+
+USER_SIMULATOR_INSTRUCTIONS = (
+    "You are playing the human in a conversation with an AI assistant. "
+    "The human opened the conversation with this message:\n\n{prompt}\n\n"
+    "Each message you receive is the assistant's latest reply. "
+    "Answer with the human's next message only, without any prefix."
+)
+
+SUMMARY_PROMPT = (
+    "Summarize the following conversation in a few sentences, keeping every fact, "
+    "name and open question needed to continue it.\n\n{transcript}"
+)
+
+
+def estimate_tokens(chars: int) -> int:
+    """Rough token estimate (about four characters per token) used for context accounting."""
+    return (chars + 3) // 4
+
+
+def _message(role: str, text: str) -> Dict[str, Any]:
+    return {"role": role, "parts": [text]}
+
+
+def _message_chars(message: Dict[str, Any]) -> int:
+    if "content" in message:
+        return len(message["content"])
+    return sum(len(part) for part in message["parts"])
+
+
+class ContextPolicy:
+    """
+    How much history a ``ChatSession`` sends with each message.
+
+    ``window`` (the default) sends the most recent messages that fit in
+    ``window_messages`` and ``max_context_chars``; without either cap it keeps the last
+    ``CHAT_WINDOW_MESSAGES`` messages. ``summary`` folds everything but the last
+    ``keep_recent_messages`` into a model-written summary whenever the history grows
+    past ``max_context_chars``. ``full`` sends the whole history, so the context grows
+    with every turn.
+    """
+
+    def __init__(
+        self, mode: str = "window", max_context_chars: Optional[int] = None,
+        window_messages: Optional[int] = None, keep_recent_messages: int = 4
+    ):
+        if mode not in CONTEXT_MODES:
+            raise ValueError(f"Invalid context mode: {mode}")
+        if mode == "summary" and not max_context_chars:
+            raise ValueError("The summary context mode requires max_context_chars")
+        if mode == "window" and not window_messages and not max_context_chars:
+            window_messages = Config.CHAT_WINDOW_MESSAGES
+        self.mode = mode
+        self.max_context_chars = max_context_chars
+        self.window_messages = window_messages
+        self.keep_recent_messages = keep_recent_messages
+
+    @classmethod
+    def from_dict(cls, options: Optional[Dict[str, Any]]) -> "ContextPolicy":
+        return cls(**(options or {}))
+
+
+class ChatSession:
+    """
+    One side of a generated conversation, backed by ``GeminiClient.generate_chat_response``.
+
+    The session keeps its own history as chat messages instead of re-rendering it into
+    one prompt. Every turn sends the new message together with the history the
+    ``policy`` selects: a window of recent messages by default, so the context stays
+    bounded. ``preamble`` messages are pinned at the start of the context and never
+    dropped or summarized.
+    """
+
+    def __init__(
+        self, client, model: str, policy: Optional[ContextPolicy] = None,
+        preamble: Optional[List[Dict[str, Any]]] = None, variant: Optional[Any] = None,
+        cache_mode: Optional[str] = None
+    ):
+        self.client = client
+        self.model = model
+        self.policy = policy or ContextPolicy()
+        self.preamble = preamble or []
+        self.variant = variant
+        self.cache_mode = cache_mode
+        self.history: List[Dict[str, Any]] = []
+        self.summary: Optional[str] = None
+        self.sent_chars = 0
+
+    def _summary_messages(self) -> List[Dict[str, Any]]:
+        if self.summary is None:
+            return []
+        return [
+            _message("user", f"Summary of the conversation so far: {self.summary}"),
+            _message("model", "Understood. Let's continue."),
+        ]
+
+    def _recent_history(self) -> List[Dict[str, Any]]:
+        if self.policy.mode != "window":
+            return self.history
+        budget = self.policy.max_context_chars
+        limit = self.policy.window_messages or len(self.history)
+        kept = 0
+        chars = 0
+        # Walk back over whole user/model pairs so the window always starts with a user message
+        for start in range(len(self.history) - 2, -1, -2):
+            pair_chars = _message_chars(self.history[start]) + _message_chars(self.history[start + 1])
+            if kept + 2 > limit or (budget is not None and chars + pair_chars > budget):
+                break
+            kept += 2
+            chars += pair_chars
+        return self.history[len(self.history) - kept:]
+
+    async def _maybe_summarize(self):
+        if self.policy.mode != "summary":
+            return
+        if sum(_message_chars(message) for message in self.history) <= self.policy.max_context_chars:
+            return
+        keep = self.policy.keep_recent_messages - self.policy.keep_recent_messages % 2
+        folded = self.history[:len(self.history) - keep]
+        if not folded:
+            return
+        lines = [f"Previous summary: {self.summary}"] if self.summary else []
+        lines.extend(
+            f"{'Human' if message['role'] == 'user' else 'AI'}: {''.join(message['parts'])}"
+            for message in folded
+        )
+        prompt = SUMMARY_PROMPT.format(transcript="\n\n".join(lines))
+        self.sent_chars += len(prompt)
+        self.summary = await self.client.generate_response(
+            prompt, self.model, cache_mode=self.cache_mode, variant=self.variant
+        )
+        self.history = self.history[len(folded):]
+
+    async def send(self, text: str) -> str:
+        await self._maybe_summarize()
+        messages = self.preamble + self._summary_messages() + self._recent_history()
+        messages = messages + [{"role": "user", "content": text}]
+        self.sent_chars += sum(_message_chars(message) for message in messages)
+        reply = await self.client.generate_chat_response(
+            messages, self.model, cache_mode=self.cache_mode, variant=self.variant
+        )
+        self.history.append(_message("user", text))
+        self.history.append(_message("model", reply))
+        return reply
+
+
+def legacy_prompt_chars(prompt: str, conversation: List[Dict[str, Any]]) -> int:
+    """
+    Characters the transcript-concatenating multi-turn mode would have sent to produce
+    ``conversation``, used as the baseline for the savings report.
+    """
+    total = 0
+    current_prompt = prompt
+    for turn in range(0, len(conversation) - 1, 2):
+        input_content = conversation[turn]["input"]["content"]
+        output_content = conversation[turn + 1]["output"]["content"]
+        if turn:
+            total += len(current_prompt)
+        output_prompt = f"{current_prompt}\n\nHuman: {input_content}\n\nAI:"
+        total += len(output_prompt)
+        current_prompt = f"{output_prompt} {output_content}"
+    return total
+
+
+async def generate_chat_conversation(
+    client, prompt: str, num_turns: int, model: str, policy: Optional[ContextPolicy] = None,
+    variant: Optional[Any] = None, cache_mode: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Generate a ``num_turns`` conversation with one chat session for the assistant and
+    one for the simulated human.
+
+    Returns the conversation in the ``input``/``output`` turn format together with the
+    estimated prompt tokens sent, the tokens the concatenating mode would have sent for
+    the same conversation, and the difference.
+    """
+    assistant = ChatSession(client, model, policy, variant=variant, cache_mode=cache_mode)
+    human = ChatSession(
+        client, model, policy,
+        preamble=[
+            _message("user", USER_SIMULATOR_INSTRUCTIONS.format(prompt=prompt)),
+            _message("model", "Understood."),
+        ],
+        variant=variant, cache_mode=cache_mode
+    )
+
+    conversation = []
+    input_content = prompt
+    for turn in range(num_turns):
+        if turn:
+            input_content = await human.send(output_content)
+        conversation.append({"input": {"content": input_content}})
+        output_content = await assistant.send(input_content)
+        conversation.append({"output": {"content": output_content}})
+
+    sent = estimate_tokens(assistant.sent_chars + human.sent_chars)
+    baseline = estimate_tokens(legacy_prompt_chars(prompt, conversation))
+    return conversation, {
+        "prompt_tokens": sent,
+        "baseline_prompt_tokens": baseline,
+        "prompt_tokens_saved": baseline - sent,
+    }
@@ -0,0 +1,190 @@
+import os
+import json
+import hashlib
+import textwrap
+import aiofiles
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+_INSTANCES_PLACEHOLDER = "\0instances\0"
+
+
+def _truncate_partial_line(path: str):
+    """Drop a trailing line left half-written by a crash so appends start on a clean line."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        position = size
+        while position > 0:
+            step = min(65536, position)
+            f.seek(position - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                end = position - step + newline + 1
+                break
+            position -= step
+        else:
+            end = 0
+        if end != size:
+            f.truncate(end)
+
+
+class BatchCheckpoint:
+    """
+    Append-only checkpoint for ``DatasetGenerator.generate_batch_dataset``.
+
+    Every finished instance is appended to ``instances.jsonl`` and its
+    ``(request_id, sample_id)`` pair is then recorded in ``manifest.jsonl``. Only pairs in
+    the manifest count as done, so an instance whose manifest entry was lost in a crash
+    is simply generated again (the later copy wins during compaction).
+    """
+
+    def __init__(self, directory: str, fingerprint: str):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.log_path = os.path.join(directory, "instances.jsonl")
+        self.manifest_path = os.path.join(directory, "manifest.jsonl")
+        self._log = None
+        self._manifest = None
+
+    @staticmethod
+    def batch_fingerprint(batch: List[Dict[str, Any]], fine_tuning_format: bool) -> str:
+        payload = json.dumps({"batch": batch, "fine_tuning_format": fine_tuning_format}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def load(self) -> Set[Tuple[int, int]]:
+        """Return the completed ``(request_id, sample_id)`` pairs, validating the batch fingerprint."""
+        os.makedirs(self.directory, exist_ok=True)
+        _truncate_partial_line(self.log_path)
+        _truncate_partial_line(self.manifest_path)
+        completed = set()
+        if not os.path.exists(self.manifest_path) or os.path.getsize(self.manifest_path) == 0:
+            with open(self.manifest_path, "w") as f:
+                f.write(json.dumps({"fingerprint": self.fingerprint}) + "\n")
+            return completed
+        with open(self.manifest_path) as f:
+            header = json.loads(f.readline())
+            if header.get("fingerprint") != self.fingerprint:
+                raise ValueError(
+                    f"Checkpoint in {self.directory} was written for a different batch; "
+                    "remove it or use another checkpoint directory"
+                )
+            for line in f:
+                request_id, sample_id = json.loads(line)
+                completed.add((request_id, sample_id))
+        return completed
+
+    async def open(self):
+        self._log = await aiofiles.open(self.log_path, mode="a")
+        self._manifest = await aiofiles.open(self.manifest_path, mode="a")
+
+    async def close(self):
+        for f in (self._log, self._manifest):
+            if f is not None:
+                await f.close()
+        self._log = self._manifest = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def append(self, request_id: int, sample_id: int, instance: Dict[str, Any]):
+        await self._log.write(json.dumps({"request_id": request_id, "sample_id": sample_id, "instance": instance}) + "\n")
+        await self._log.flush()
+        await self._manifest.write(json.dumps([request_id, sample_id]) + "\n")
+        await self._manifest.flush()
+
+    def compact(self, output_file: str, batch: List[Dict[str, Any]], completed: Optional[Set[Tuple[int, int]]] = None):
+        """
+        Write the checkpointed instances to ``output_file`` in the ``batch_output.json``
+        layout (one ``indent=4`` object per request), streaming one instance at a time.
+
+        ``batch`` holds the per-request headers (``id``, ``model``, ``metadata``) in order.
+        """
+        write_batch_output(output_file, batch, self._locations(completed))
+
+    def entries(self, completed: Optional[Set[Tuple[int, int]]] = None) -> Iterator[Dict[str, Any]]:
+        """Yield the checkpointed log entries (``request_id``, ``sample_id``, ``instance``) in order."""
+        locations = self._locations(completed)
+        with open(self.log_path, "rb") as log:
+            for request_id in sorted(locations):
+                for sample_id in sorted(locations[request_id]):
+                    log.seek(locations[request_id][sample_id][1])
+                    yield json.loads(log.readline())
+
+    def _locations(self, completed: Optional[Set[Tuple[int, int]]]) -> Dict[int, Dict[int, Tuple[str, int]]]:
+        if completed is None:
+            completed = self.load()
+        locations: Dict[int, Dict[int, Tuple[str, int]]] = {}
+        for request_id, sample_id, offset in scan_instance_log(self.log_path):
+            if (request_id, sample_id) in completed:
+                locations.setdefault(request_id, {})[sample_id] = (self.log_path, offset)
+        return locations
+
+
+def scan_instance_log(path: str) -> Iterator[Tuple[int, int, int]]:
+    """
+    Yield ``(request_id, sample_id, offset)`` for every complete entry of an instance
+    log, skipping a trailing line left half-written by a crash.
+    """
+    with open(path, "rb") as log:
+        offset = 0
+        for line in log:
+            if line.endswith(b"\n"):
+                entry = json.loads(line)
+                yield entry["request_id"], entry["sample_id"], offset
+            offset += len(line)
+
+
+def write_batch_output(
+    output_file: str, batch: Iterable[Dict[str, Any]], locations: Dict[int, Dict[int, Tuple[str, int]]]
+):
+    """
+    Write instances to ``output_file`` in the ``batch_output.json`` layout (one
+    ``indent=4`` object per request), streaming one instance at a time.
+
+    ``batch`` holds the per-request headers (``id``, ``model``, ``metadata``) in order and
+    ``locations`` maps request ids to the ``(log path, offset)`` of each sample's entry.
+    """
+    logs: Dict[str, Any] = {}
+    temp_file = output_file + ".tmp"
+    try:
+        with open(temp_file, "w") as out:
+            for model_data in batch:
+                # Same key order as the uncheckpointed layout: instances before metadata
+                header = {
+                    "id": model_data["id"],
+                    "model": model_data["model"],
+                    "instances": _INSTANCES_PLACEHOLDER,
+                    "metadata": model_data["metadata"],
+                }
+                prefix, suffix = json.dumps(header, indent=4).split(json.dumps(_INSTANCES_PLACEHOLDER))
+                out.write(prefix)
+                request_locations = locations.get(model_data["id"], {})
+                if not request_locations:
+                    out.write("[]")
+                else:
+                    out.write("[\n")
+                    for position, sample_id in enumerate(sorted(request_locations)):
+                        path, offset = request_locations[sample_id]
+                        log = logs.get(path)
+                        if log is None:
+                            log = logs[path] = open(path, "rb")
+                        log.seek(offset)
+                        instance = json.loads(log.readline())["instance"]
+                        if position:
+                            out.write(",\n")
+                        out.write(textwrap.indent(json.dumps(instance, indent=4), " " * 8))
+                    out.write("\n    ]")
+                out.write(suffix + "\n")
+    finally:
+        for log in logs.values():
+            log.close()
+    os.replace(temp_file, output_file)
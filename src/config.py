@@ -6,4 +6,27 @@ load_dotenv()
 class Config:
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
     GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
-    MAX_CONCURRENT_TASKS = int(os.getenv("MAX_CONCURRENT_TASKS", 10))
\ No newline at end of file
+    MODEL_BACKEND = os.getenv("MODEL_BACKEND", "gemini")
+    MAX_CONCURRENT_TASKS = int(os.getenv("MAX_CONCURRENT_TASKS", 10))
+    MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", 2))
+    JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 30))
+    JOB_DB_PATH = os.getenv("JOB_DB_PATH", "output/jobs.db")
+    RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR")
+    RESPONSE_CACHE_MODE = os.getenv("RESPONSE_CACHE_MODE", "read-write")
+    RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", 1024))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 1024 ** 3))
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL")) if os.getenv("RESPONSE_CACHE_TTL") else None
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+    MODEL_REQUESTS_PER_MINUTE = os.getenv("MODEL_REQUESTS_PER_MINUTE")
+    MODEL_TOKENS_PER_MINUTE = os.getenv("MODEL_TOKENS_PER_MINUTE")
+    ADAPTIVE_CONCURRENCY_MAX = int(os.getenv("ADAPTIVE_CONCURRENCY_MAX", 64))
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+    CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+    RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 5))
+    RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.5))
+    RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 30))
+    STRUCTURED_MAX_ATTEMPTS = int(os.getenv("STRUCTURED_MAX_ATTEMPTS", 3))
+    CHAT_WINDOW_MESSAGES = int(os.getenv("CHAT_WINDOW_MESSAGES", 8))
+    PACKING_MAX_SAMPLES = int(os.getenv("PACKING_MAX_SAMPLES", 8))
+    PACKING_MAX_OUTPUT_TOKENS = int(os.getenv("PACKING_MAX_OUTPUT_TOKENS", 8192))
+    WARMUP_MODELS = os.getenv("WARMUP_MODELS")
\ No newline at end of file
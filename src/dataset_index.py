@@ -0,0 +1,279 @@
+import os
+import json
+import mmap
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
+
+INDEX_VERSION = 1
+
+# One fixed-width entry per record; -1 marks a field the record does not carry
+ENTRY_DTYPE = np.dtype([
+    ("offset", "<u8"),
+    ("length", "<u4"),
+    ("sample_id", "<i8"),
+    ("num_turns", "<i2"),
+    ("model", "<i2"),
+])
+
+
+def index_paths(path: str) -> Tuple[str, str]:
+    """Return the ``(entries, metadata)`` sidecar paths of the dataset at ``path``."""
+    return f"{path}.idx", f"{path}.idx.json"
+
+
+def record_fields(record: Any) -> Tuple[int, int, Optional[str]]:
+    """
+    Extract ``(sample_id, num_turns, model)`` from a generated record: a single-turn
+    sample, a fine-tuning ``messages`` record or a bare conversation list.
+    """
+    if isinstance(record, list):
+        return -1, sum(1 for turn in record if isinstance(turn, dict) and "input" in turn), None
+    if not isinstance(record, dict):
+        return -1, -1, None
+    metadata = record.get("metadata") or {}
+    sample_id = metadata.get("sample_id", metadata.get("conversation_index", -1))
+    num_turns = metadata.get("num_turns")
+    if num_turns is None:
+        if "messages" in record:
+            num_turns = sum(1 for message in record["messages"] if message.get("role") == "user")
+        elif "conversation" in record:
+            num_turns = sum(1 for turn in record["conversation"] if "input" in turn)
+        elif "response" in record:
+            num_turns = 1
+        else:
+            num_turns = -1
+    return sample_id, num_turns, metadata.get("model")
+
+
+class OffsetIndexWriter:
+    """
+    Write the offset index of a JSONL dataset while it is being written.
+
+    Call ``add`` with the encoded length of every line in file order. Entries go to
+    ``<path>.idx`` and the model names they refer to to ``<path>.idx.json``; a fresh
+    writer truncates both, matching a dataset file that is opened for writing.
+    """
+
+    def __init__(self, path: str, offset: int = 0, models: Optional[List[str]] = None, flush_every: int = 1024):
+        self.path = path
+        self.entries_path, self.metadata_path = index_paths(path)
+        self.offset = offset
+        self.models = list(models or [])
+        self.flush_every = flush_every
+        self._model_ids = {model: idx for idx, model in enumerate(self.models)}
+        self._pending: List[Tuple[int, int, int, int, int]] = []
+        self._file = open(self.entries_path, "ab" if offset else "wb")
+        self._write_metadata()
+
+    def _write_metadata(self):
+        temp_path = f"{self.metadata_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": INDEX_VERSION, "models": self.models}, f)
+        os.replace(temp_path, self.metadata_path)
+
+    def add(self, length: int, record: Any):
+        sample_id, num_turns, model = record_fields(record)
+        model_id = -1
+        if model is not None:
+            model_id = self._model_ids.get(model)
+            if model_id is None:
+                # Persist the name before any entry refers to it
+                model_id = self._model_ids[model] = len(self.models)
+                self.models.append(model)
+                self._write_metadata()
+        self._pending.append((self.offset, length, sample_id, num_turns, model_id))
+        self.offset += length
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._file.write(np.array(self._pending, dtype=ENTRY_DTYPE).tobytes())
+            self._pending = []
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def build_index(path: str) -> int:
+    """
+    Create or update the offset index of the JSONL file at ``path``, parsing only the
+    lines not indexed yet, and return the number of indexed records. A trailing line
+    without a newline (a write in progress) is left for a later update.
+    """
+    entries_path, metadata_path = index_paths(path)
+    offset = 0
+    models: List[str] = []
+    count = 0
+    if os.path.exists(entries_path) and os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            models = json.load(f)["models"]
+        size = os.path.getsize(entries_path)
+        count = size // ENTRY_DTYPE.itemsize
+        if size % ENTRY_DTYPE.itemsize:
+            # Drop an entry left half-written by a crash
+            with open(entries_path, "rb+") as f:
+                f.truncate(count * ENTRY_DTYPE.itemsize)
+        if count:
+            last = np.fromfile(entries_path, dtype=ENTRY_DTYPE, count=1, offset=(count - 1) * ENTRY_DTYPE.itemsize)[0]
+            offset = int(last["offset"]) + int(last["length"])
+        if offset > os.path.getsize(path):
+            # The dataset was rewritten since it was indexed
+            offset, models, count = 0, [], 0
+
+    writer = OffsetIndexWriter(path, offset, models)
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                record = None
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        pass
+                if record is None:
+                    # Keep blank and malformed lines out of the index but account for their bytes
+                    writer.offset += len(line)
+                    continue
+                writer.add(len(line), record)
+                count += 1
+    finally:
+        writer.close()
+    return count
+
+
+class DatasetView:
+    """
+    A sequence of records of a memory-mapped dataset, selected by their positions in
+    the offset index. Slicing, filtering, shuffling and splitting return new views
+    without reading any records; records are only parsed when accessed.
+    """
+
+    def __init__(self, reader: "DatasetReader", positions: Union[range, np.ndarray]):
+        self._reader = reader
+        self._positions = positions
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    @property
+    def entries(self) -> np.ndarray:
+        """Index entries of the view; a view of the mapped index when the positions are a range."""
+        positions = self._positions
+        if isinstance(positions, range):
+            return self._reader._entries[positions.start:positions.stop:positions.step]
+        return self._reader._entries[positions]
+
+    @property
+    def sample_ids(self) -> np.ndarray:
+        return self.entries["sample_id"]
+
+    def _position(self, idx: int) -> int:
+        return self._positions[idx]
+
+    def raw(self, idx: int) -> memoryview:
+        """Return the bytes of a record (without its newline) as a zero-copy view of the mapped file."""
+        entry = self._reader._entries[self._position(idx)]
+        start = int(entry["offset"])
+        return self._reader._data[start:start + int(entry["length"]) - 1]
+
+    def __getitem__(self, idx: Union[int, slice]) -> Any:
+        if isinstance(idx, slice):
+            return DatasetView(self._reader, self._positions[idx])
+        return json.loads(self.raw(idx).tobytes())
+
+    def __iter__(self) -> Iterator[Any]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def filter(
+        self, model: Optional[str] = None, num_turns: Optional[int] = None, sample_id: Optional[int] = None
+    ) -> "DatasetView":
+        """Select the records matching every given metadata field, using only the index."""
+        entries = self.entries
+        mask = np.ones(len(entries), dtype=bool)
+        if model is not None:
+            model_id = self._reader.models.index(model) if model in self._reader.models else -2
+            mask &= entries["model"] == model_id
+        if num_turns is not None:
+            mask &= entries["num_turns"] == num_turns
+        if sample_id is not None:
+            mask &= entries["sample_id"] == sample_id
+        return DatasetView(self._reader, np.asarray(self._positions)[mask])
+
+    def shuffled(self, seed: int = 0) -> "DatasetView":
+        """Return the records in a random order that is reproducible for ``seed``."""
+        order = np.random.default_rng(seed).permutation(len(self))
+        return DatasetView(self._reader, np.asarray(self._positions)[order])
+
+    def split(self, eval_fraction: float = 0.1, seed: Optional[int] = 0) -> Tuple["DatasetView", "DatasetView"]:
+        """
+        Split into ``(train, eval)`` views with ``eval_fraction`` of the records in
+        ``eval``, shuffling first with ``seed`` (pass ``None`` to split in file order).
+        """
+        view = self.shuffled(seed) if seed is not None else self
+        cut = len(view) - int(round(len(view) * eval_fraction))
+        return view[:cut], view[cut:]
+
+
+class DatasetReader(DatasetView):
+    """
+    Random-access reader over a JSONL dataset and its offset index.
+
+    The dataset and the index are memory-mapped, so opening a reader costs the same
+    regardless of the dataset size and record ``i`` is read with a single lookup. The
+    index is built (or extended to cover newly appended records) when it does not match
+    the file. Views returned by ``raw`` must be released before ``close``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        entries_path, metadata_path = index_paths(path)
+        if not self._index_current():
+            build_index(path)
+        with open(metadata_path) as f:
+            metadata: Dict[str, Any] = json.load(f)
+        if metadata.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported index version {metadata.get('version')} for {path}")
+        self.models: List[str] = metadata["models"]
+
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._data = memoryview(self._mmap) if self._mmap is not None else memoryview(b"")
+        count = os.path.getsize(entries_path) // ENTRY_DTYPE.itemsize
+        self._entries = (
+            np.memmap(entries_path, dtype=ENTRY_DTYPE, mode="r", shape=(count,)) if count
+            else np.zeros(0, dtype=ENTRY_DTYPE)
+        )
+        super().__init__(self, range(count))
+
+    def _index_current(self) -> bool:
+        entries_path, metadata_path = index_paths(self.path)
+        if not (os.path.exists(entries_path) and os.path.exists(metadata_path)):
+            return False
+        size = os.path.getsize(entries_path)
+        if size % ENTRY_DTYPE.itemsize:
+            return False
+        if not size:
+            return os.path.getsize(self.path) == 0
+        last = np.fromfile(entries_path, dtype=ENTRY_DTYPE, count=1, offset=size - ENTRY_DTYPE.itemsize)[0]
+        return int(last["offset"]) + int(last["length"]) == os.path.getsize(self.path)
+
+    def close(self):
+        self._entries = np.zeros(0, dtype=ENTRY_DTYPE)
+        self._data.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
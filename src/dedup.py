@@ -0,0 +1,244 @@
+import re
+import zlib
+import sqlite3
+import hashlib
+from typing import Any, Iterable, List, Optional, Tuple
+import numpy as np
+from src.pipeline import Pipeline, Stage
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_TOKEN = re.compile(r"\w+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    id INTEGER PRIMARY KEY,
+    key TEXT,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    band INTEGER NOT NULL,
+    hash INTEGER NOT NULL,
+    doc INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (band, hash);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def record_text(record: Any) -> str:
+    """
+    Extract the generated text of a record for similarity checks: the response of a
+    single-turn sample, the assistant messages of a fine-tuning record, or the turns of
+    a conversation after its opening prompt. Prompts are left out since they are shared
+    by every sample of a request and would make distinct samples look alike.
+    """
+    if isinstance(record, str):
+        return record
+    if isinstance(record, list):
+        # A conversation, whose first input turn is the prompt
+        turns = record[1:] if record and isinstance(record[0], dict) and "input" in record[0] else record
+        return "\n".join(filter(None, (record_text(turn) for turn in turns)))
+    if not isinstance(record, dict):
+        return ""
+    if "messages" in record:
+        return "\n".join(
+            message.get("content", "") for message in record["messages"] if message.get("role") == "assistant"
+        )
+    if "response" in record:
+        return record["response"]
+    if "output" in record:
+        return record_text(record["output"])
+    if "conversation" in record:
+        return record_text(record["conversation"])
+    parts = [record_text(record[key]) for key in ("content", "input") if key in record]
+    return "\n".join(filter(None, parts))
+
+
+def _lsh_parameters(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """Pick the (bands, rows) split whose S-curve threshold (1/b)^(1/r) is closest to ``threshold``."""
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        distance = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or distance < best[0]:
+            best = (distance, bands, rows)
+    return best[1], best[2]
+
+
+class MinHasher:
+    """MinHash signatures over word shingles, computed for all permutations at once with numpy."""
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    def _shingle_hashes(self, text: str) -> np.ndarray:
+        tokens = _TOKEN.findall(text.lower())
+        size = min(self.shingle_size, len(tokens)) or 1
+        shingles = {" ".join(tokens[i:i + size]) for i in range(max(len(tokens) - size + 1, 1))}
+        return np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles)
+        )
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self._shingle_hashes(text)
+        # (num_perm, num_shingles) matrix of permuted hashes; uint64 overflow wraps as intended
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _MERSENNE_PRIME
+        return np.bitwise_and(permuted, _MAX_HASH).min(axis=1)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash LSH index stored in SQLite, so it can grow across runs.
+
+    ``path=None`` keeps the index in memory. The MinHash settings are stored with the
+    index and an existing index must be opened with the same ones.
+    """
+
+    def __init__(self, path: Optional[str] = None, threshold: float = 0.8, num_perm: int = 128,
+                 shingle_size: int = 3, seed: int = 1):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle_size, seed)
+        self.bands, self.rows = _lsh_parameters(threshold, num_perm)
+        self._conn = sqlite3.connect(path or ":memory:")
+        self._conn.executescript(SCHEMA)
+        settings = {"num_perm": str(num_perm), "shingle_size": str(shingle_size), "seed": str(seed)}
+        stored = dict(self._conn.execute("SELECT name, value FROM settings").fetchall())
+        if stored and stored != settings:
+            raise ValueError(f"Dedup index {path} was built with different settings: {stored}")
+        if not stored:
+            self._conn.executemany("INSERT INTO settings (name, value) VALUES (?, ?)", settings.items())
+            self._conn.commit()
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+    def commit(self):
+        self._conn.commit()
+
+    def _band_hashes(self, signature: np.ndarray) -> List[int]:
+        return [
+            int.from_bytes(
+                hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).digest(),
+                "big", signed=True
+            )
+            for band in range(self.bands)
+        ]
+
+    def query(self, signature: np.ndarray, band_hashes: Optional[List[int]] = None) -> Optional[str]:
+        """Return the key of an indexed document at least ``threshold`` similar, if any."""
+        band_hashes = band_hashes or self._band_hashes(signature)
+        candidates = set()
+        for band, band_hash in enumerate(band_hashes):
+            candidates.update(
+                row[0] for row in self._conn.execute(
+                    "SELECT doc FROM buckets WHERE band = ? AND hash = ?", (band, band_hash)
+                )
+            )
+        for doc in candidates:
+            key, blob = self._conn.execute("SELECT key, signature FROM signatures WHERE id = ?", (doc,)).fetchone()
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint64) == signature))
+            if similarity >= self.threshold:
+                return key if key is not None else str(doc)
+        return None
+
+    def add(self, signature: np.ndarray, key: Optional[str] = None, band_hashes: Optional[List[int]] = None):
+        band_hashes = band_hashes or self._band_hashes(signature)
+        doc = self._conn.execute(
+            "INSERT INTO signatures (key, signature) VALUES (?, ?)", (key, signature.tobytes())
+        ).lastrowid
+        self._conn.executemany(
+            "INSERT INTO buckets (band, hash, doc) VALUES (?, ?, ?)",
+            ((band, band_hash, doc) for band, band_hash in enumerate(band_hashes))
+        )
+
+    def check_and_add(self, text: str, key: Optional[str] = None) -> Optional[str]:
+        """
+        Return the key of a near-duplicate already in the index, or add ``text`` and
+        return ``None`` if it is new.
+        """
+        signature = self.hasher.signature(text)
+        band_hashes = self._band_hashes(signature)
+        match = self.query(signature, band_hashes)
+        if match is None:
+            self.add(signature, key, band_hashes)
+        return match
+
+
+class NearDuplicateFilter:
+    """
+    Drop generated records that are near-duplicates of earlier ones.
+
+    Used inline by ``DatasetGenerator`` (``dedup=`` on the streaming methods) or offline
+    through ``DedupStage``. With ``regenerate`` set, the generator retries a dropped
+    sample up to ``max_attempts`` times so the requested count is still met.
+    """
+
+    def __init__(self, index: Optional[NearDuplicateIndex] = None, regenerate: bool = False,
+                 max_attempts: int = 3, commit_every: int = 100):
+        self.index = index or NearDuplicateIndex()
+        self.regenerate = regenerate
+        self.max_attempts = max_attempts
+        self.commit_every = commit_every
+        self.kept = 0
+        self.dropped = 0
+
+    def is_duplicate(self, record: Any, key: Optional[str] = None) -> bool:
+        duplicate = self.index.check_and_add(record_text(record), key) is not None
+        if duplicate:
+            self.dropped += 1
+        else:
+            self.kept += 1
+            if self.kept % self.commit_every == 0:
+                self.index.commit()
+        return duplicate
+
+    def add_records(self, records: Iterable[Any]):
+        """Seed the index with an existing dataset without filtering it."""
+        for record in records:
+            for item in record.get("instances", [record]) if isinstance(record, dict) else [record]:
+                self.is_duplicate(item)
+        self.flush()
+
+    def flush(self):
+        self.index.commit()
+
+    def close(self):
+        self.index.close()
+
+
+class DedupStage(Stage):
+    """
+    Pipeline stage that drops near-duplicate records. Batch records (with an
+    ``instances`` list) have their duplicate instances removed instead.
+    """
+
+    def __init__(self, dedup: NearDuplicateFilter):
+        self.dedup = dedup
+
+    async def process(self, record: Any) -> Optional[Any]:
+        if isinstance(record, dict) and isinstance(record.get("instances"), list):
+            record["instances"] = [instance for instance in record["instances"] if not self.dedup.is_duplicate(instance)]
+            return record
+        return None if self.dedup.is_duplicate(record) else record
+
+    async def close(self):
+        self.dedup.flush()
+
+
+async def dedup_file(input_path: str, output_path: str, dedup: Optional[NearDuplicateFilter] = None, **kwargs) -> int:
+    """Write ``input_path`` to ``output_path`` without near-duplicates; see ``Pipeline.run`` for ``kwargs``."""
+    dedup = dedup or NearDuplicateFilter()
+    # Records must be checked in input order for the result to be deterministic
+    return await Pipeline([DedupStage(dedup)], max_in_flight=1).run(input_path, output_path, **kwargs)
@@ -1,29 +1,168 @@
-import google.generativeai as genai
-from dotenv import load_dotenv
-import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Sequence
+from src import metrics
+from src.backends import BackendError, ModelBackend, ModelResponse, create_backend
+from src.cache import ResponseCache
+from src.config import Config
+from src.rate_limit import RateLimiter, RetryPolicy, error_kind
+
+logger = logging.getLogger(__name__)
 
 class GeminiClient:
-    def __init__(self):
-        load_dotenv()
-        api_key = os.getenv("API_KEY")
-        if not api_key:
-            raise ValueError("API_KEY not found in environment variables")
-        genai.configure(api_key=api_key)
-        self.models = {
-            "gemini-pro": genai.GenerativeModel("gemini-pro"),
-            "gemini-1.5-pro": genai.GenerativeModel("gemini-1.5-pro"),
-            "gemini-1.5-flash": genai.GenerativeModel("gemini-1.5-flash")
-        }
-
-    async def generate_response(self, prompt, model):
-        if model not in self.models:
+    def __init__(
+        self, cache: Optional[ResponseCache] = None, cache_mode: Optional[str] = None,
+        backend: Optional[ModelBackend] = None, rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None
+    ):
+        self.backend = backend or create_backend()
+        self.rate_limiter = rate_limiter or RateLimiter.from_config()
+        self.retry_policy = retry_policy or RetryPolicy(
+            Config.RETRY_MAX_ATTEMPTS, Config.RETRY_BASE_DELAY, Config.RETRY_MAX_DELAY
+        )
+        if cache is None and Config.RESPONSE_CACHE_DIR:
+            cache = ResponseCache(
+                Config.RESPONSE_CACHE_DIR,
+                memory_entries=Config.RESPONSE_CACHE_MEMORY_ENTRIES,
+                max_bytes=Config.RESPONSE_CACHE_MAX_BYTES,
+                ttl=Config.RESPONSE_CACHE_TTL
+            )
+        self.cache = cache
+        self.cache_mode = cache_mode or Config.RESPONSE_CACHE_MODE
+
+    async def warm_up(self, models: Optional[Sequence[str]] = None):
+        """
+        Set up the backend clients of ``models`` (default: ``WARMUP_MODELS``) before the
+        first request, so it does not pay for SDK imports and client construction.
+        """
+        if models is None:
+            models = [model.strip() for model in (Config.WARMUP_MODELS or "").split(",") if model.strip()]
+        models = [model for model in models if self.backend.supports(model)]
+        if not models:
+            return
+        start = time.perf_counter()
+        await self.backend.warm_up(models)
+        logger.info(f"Warmed up {', '.join(models)} in {time.perf_counter() - start:.2f}s")
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else {}
+
+    async def _cached(self, call, cache_mode: Optional[str], *key_parts: Any) -> str:
+        if self.cache is None:
+            return await call()
+        key = ResponseCache.make_key(*key_parts)
+        return await self.cache.get_or_call(key, call, cache_mode or self.cache_mode)
+
+    async def _observed(self, call: str, model: str, request: Awaitable[ModelResponse]) -> ModelResponse:
+        if not metrics.enabled:
+            return await request
+        metrics.UPSTREAM_REQUESTS.inc(model, call)
+        metrics.UPSTREAM_IN_FLIGHT.inc(model)
+        start = time.perf_counter()
+        try:
+            response = await request
+        except BackendError as e:
+            metrics.UPSTREAM_ERRORS.inc(model, call, str(e.status_code or "unknown"))
+            raise
+        except Exception as e:
+            metrics.UPSTREAM_ERRORS.inc(model, call, type(e).__name__)
+            raise
+        finally:
+            metrics.UPSTREAM_IN_FLIGHT.dec(model)
+            metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - start, model, call)
+        if response.prompt_tokens is not None:
+            metrics.TOKENS.inc(model, "in", amount=response.prompt_tokens)
+        if response.output_tokens is not None:
+            metrics.TOKENS.inc(model, "out", amount=response.output_tokens)
+        return response
+
+    async def _call_backend(
+        self, call: str, model: str, request: Callable[[], Awaitable[ModelResponse]], prompt_chars: int
+    ) -> ModelResponse:
+        """
+        Call the backend within the model's rate limits, retrying rate limits, server
+        errors and timeouts with jittered exponential backoff.
+        """
+        limiter = self.rate_limiter.for_model(model)
+        estimated_tokens = (prompt_chars + 3) // 4
+        attempt = 0
+        while True:
+            try:
+                epoch = await limiter.acquire(estimated_tokens)
+                response = error = None
+                try:
+                    response = await self._observed(call, model, request())
+                    return response
+                except BaseException as e:
+                    error = e
+                    raise
+                finally:
+                    await limiter.release(epoch, estimated_tokens, response, error)
+            except Exception as e:
+                kind = error_kind(e)
+                attempt += 1
+                if kind is None or attempt >= self.retry_policy.max_attempts:
+                    raise
+                if metrics.enabled:
+                    metrics.RETRIES.inc(model, kind)
+                await asyncio.sleep(self.retry_policy.delay(attempt - 1, getattr(e, "retry_after", None)))
+
+    async def _generate_response(self, prompt, model, response_schema=None):
+        if response_schema is None:
+            request = lambda: self.backend.generate(model, prompt)
+        else:
+            request = lambda: self.backend.generate(model, prompt, response_schema=response_schema)
+        response = await self._call_backend("generate", model, request, len(prompt))
+        return response.text
+
+    async def generate_response(self, prompt, model, cache_mode=None, variant=None, response_schema=None):
+        """
+        ``variant`` is part of the cache key and distinguishes calls that are identical on
+        purpose, e.g. the sample index when generating many samples from one prompt.
+        ``response_schema`` asks for JSON output following the given JSON schema.
+        """
+        if not self.backend.supports(model):
             raise ValueError(f"Invalid model name: {model}")
-        response = await self.models[model].generate_content_async(prompt)
+        # The schema only joins the cache key when set, so plain-text entries keep their keys
+        key_parts = (model, prompt, variant) if response_schema is None else (model, prompt, variant, response_schema)
+        return await self._cached(
+            lambda: self._generate_response(prompt, model, response_schema), cache_mode, "generate", *key_parts
+        )
+
+    def max_candidates(self, model: str) -> int:
+        return self.backend.max_candidates(model)
+
+    def supports_json(self, model: str) -> bool:
+        return self.backend.supports_json(model)
+
+    async def _generate_candidates(self, prompt, model, count):
+        response = await self._call_backend(
+            "generate", model, lambda: self.backend.generate(model, prompt, candidate_count=count), len(prompt)
+        )
+        return response.candidates or [response.text]
+
+    async def generate_candidates(self, prompt, model, count, cache_mode=None, variant=None) -> List[str]:
+        """Generate ``count`` independent responses to ``prompt`` with a single call."""
+        if not self.backend.supports(model):
+            raise ValueError(f"Invalid model name: {model}")
+        if count > self.max_candidates(model):
+            raise ValueError(f"{model} supports at most {self.max_candidates(model)} candidates per call")
+        return await self._cached(
+            lambda: self._generate_candidates(prompt, model, count), cache_mode, "candidates", model, prompt, variant,
+            count
+        )
+
+    async def _generate_chat_response(self, messages, model):
+        response = await self._call_backend(
+            "chat", model, lambda: self.backend.chat(model, messages[:-1], messages[-1]['content']),
+            sum(len(str(message)) for message in messages)
+        )
         return response.text
 
-    async def generate_chat_response(self, messages, model):
-        if model not in self.models:
+    async def generate_chat_response(self, messages, model, cache_mode=None, variant=None):
+        if not self.backend.supports(model):
             raise ValueError(f"Invalid model name: {model}")
-        chat = self.models[model].start_chat(history=messages[:-1])
-        response = await chat.send_message_async(messages[-1]['content'])
-        return response.text
\ No newline at end of file
+        return await self._cached(
+            lambda: self._generate_chat_response(messages, model), cache_mode, "chat", model, messages, variant
+        )
@@ -1,107 +1,593 @@
 import os
+import re
 import asyncio
+import logging
 import aiofiles
 import json
-from typing import List, Dict, Any, AsyncGenerator, Union
+from contextlib import aclosing
+from functools import partial
+from itertools import islice
+from typing import TYPE_CHECKING, List, Dict, Any, AsyncGenerator, Awaitable, Callable, Container, Iterable, Iterator, Optional, Set, Tuple, Union
+from src.chat_session import ContextPolicy, generate_chat_conversation
+from src.checkpoint import BatchCheckpoint
+from src import metrics
+from src.config import Config
 from src.gemini_client import GeminiClient
+from src.backends import BackendError
+from src.packing import MULTI_ANSWER_PROMPT, MalformedAnswersError, PackingTuner, answers_schema, parse_answers
+from src.rate_limit import CircuitOpenError, error_kind
+from src.scheduler import GenerationScheduler
+from src.templates import PromptTemplate
+from src.structured import STRUCTURED_DIALOGUE_PROMPT, MalformedDialogueError, dialogue_schema, parse_dialogue
+from src.writer import ShardedDatasetWriter
+
+if TYPE_CHECKING:
+    # src.dedup and src.dataset_index load numpy; they are imported where used to keep it out of API startup
+    from src.dedup import NearDuplicateFilter
+
+logger = logging.getLogger(__name__)
 
 class DatasetGenerator:
-    def __init__(self):
-        self.client = GeminiClient()
+    def __init__(
+        self, max_concurrency: Optional[int] = None, cache_mode: Optional[str] = None,
+        client: Optional[GeminiClient] = None
+    ):
+        self.client = client or GeminiClient()
+        self.scheduler = GenerationScheduler(max_concurrency)
+        self.cache_mode = cache_mode
 
-    async def _generate_content(self, prompt: str, model: str) -> str:
+    async def _generate_content(
+        self, prompt: str, model: str, variant: Optional[Any] = None, response_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
         try:
-            return await self.client.generate_response(prompt, model)
+            with metrics.stage("model_call"):
+                return await self.client.generate_response(
+                    prompt, model, cache_mode=self.cache_mode, variant=variant, response_schema=response_schema
+                )
         except Exception as e:
             print(f"Error generating content: {e}")
             raise
 
+    @staticmethod
+    def _variant(sample_id: int, attempt: int) -> Any:
+        # Regenerated samples need their own cache key, or they would get the same answer back
+        return sample_id if not attempt else f"{sample_id}:{attempt}"
+
+    async def _generate_deduplicated(
+        self, generate: Callable[..., Awaitable[Any]], dedup: Optional["NearDuplicateFilter"], model: str
+    ) -> Optional[Any]:
+        """
+        Run ``generate`` and drop its result if ``dedup`` has seen a near-duplicate,
+        retrying with a fresh attempt when the filter asks for regeneration.
+        """
+        if dedup is None:
+            return await generate()
+        for attempt in range(dedup.max_attempts if dedup.regenerate else 1):
+            if attempt and metrics.enabled:
+                metrics.RETRIES.inc(model, "duplicate")
+            result = await generate(attempt=attempt)
+            if not dedup.is_duplicate(result):
+                return result
+        return None
+
+    async def _generate_single_turn_sample(
+        self, prompt: str, sample_id: int, model: str, fine_tuning_format: bool, attempt: int = 0
+    ) -> Dict[str, Any]:
+        response = await self._generate_content(prompt, model, variant=self._variant(sample_id, attempt))
+        return self._single_turn_record(prompt, response, sample_id, model, fine_tuning_format)
+
+    def _single_turn_record(
+        self, prompt: str, response: str, sample_id: int, model: str, fine_tuning_format: bool
+    ) -> Dict[str, Any]:
+        data = {
+            "prompt": prompt,
+            "response": response,
+            "metadata": {"sample_id": sample_id, "model": model}
+        }
+        if fine_tuning_format:
+            with metrics.stage("format"):
+                data = self._format_for_fine_tuning(data)
+        return data
+
+    async def _generate_packed_responses(self, prompt: str, model: str, count: int, variant: Any) -> List[str]:
+        """
+        Get ``count`` independent responses to ``prompt`` from one call: as candidates when
+        the model allows that many, otherwise through a structured multi-answer prompt.
+        """
+        if count <= self.client.max_candidates(model):
+            with metrics.stage("model_call"):
+                responses = await self.client.generate_candidates(
+                    prompt, model, count, cache_mode=self.cache_mode, variant=variant
+                )
+            # Candidates can go missing or come back empty, e.g. when they are safety-filtered
+            if len(responses) != count or not all(response and response.strip() for response in responses):
+                raise MalformedAnswersError(
+                    f"Expected {count} candidates, got {sum(1 for response in responses if response and response.strip())}"
+                )
+            return responses
+        with metrics.stage("prompt_build"):
+            packed_prompt = MULTI_ANSWER_PROMPT.format(count=count, prompt=prompt)
+        text = await self._generate_content(packed_prompt, model, variant=variant, response_schema=answers_schema(count))
+        with metrics.stage("parse"):
+            return parse_answers(text, count)
+
+    async def _generate_packed_samples(
+        self, prompt: str, sample_ids: List[int], model: str, fine_tuning_format: bool, tuner: PackingTuner,
+        dedup: Optional["NearDuplicateFilter"] = None
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Generate the samples ``sample_ids`` with a single call and split the result into
+        one record per sample. If the packed reply is malformed, or the packed call is
+        rejected (e.g. its schema by the model), the samples are generated one by one
+        instead.
+        """
+        try:
+            responses = await self._generate_packed_responses(
+                prompt, model, len(sample_ids), f"pack:{sample_ids[0]}:{len(sample_ids)}"
+            )
+        except (MalformedAnswersError, BackendError) as e:
+            tuner.record_failure()
+            if isinstance(e, BackendError) and (isinstance(e, CircuitOpenError) or error_kind(e) is not None):
+                # Rate limits and outages would fail the unpacked calls just the same
+                raise
+            reason = "malformed" if isinstance(e, MalformedAnswersError) else "rejected"
+            logger.warning(f"Packed call for samples {sample_ids[0]}-{sample_ids[-1]} {reason}, unpacking: {e}")
+            if metrics.enabled:
+                metrics.RETRIES.inc(model, reason)
+            # One after another: the pack holds a single scheduler slot, so parallel calls would exceed the cap
+            return [
+                await self._generate_deduplicated(
+                    partial(self._generate_single_turn_sample, prompt, sample_id, model, fine_tuning_format),
+                    dedup, model
+                )
+                for sample_id in sample_ids
+            ]
+        except Exception:
+            tuner.record_failure()
+            raise
+        tuner.record_success(responses)
+
+        records = []
+        for sample_id, response in zip(sample_ids, responses):
+            record = self._single_turn_record(prompt, response, sample_id, model, fine_tuning_format)
+            if dedup is not None and dedup.is_duplicate(record):
+                record = None
+                if dedup.regenerate:
+                    # The unpacked call is a fresh sample with its own cache key
+                    record = await self._generate_deduplicated(
+                        partial(self._generate_single_turn_sample, prompt, sample_id, model, fine_tuning_format),
+                        dedup, model
+                    )
+            records.append(record)
+        return records
+
+    def _packed_sample_tasks(
+        self, prompt: str, num_samples: int, model: str, fine_tuning_format: bool, tuner: PackingTuner,
+        dedup: Optional["NearDuplicateFilter"] = None
+    ) -> Iterator[Callable[[], Awaitable[List[Optional[Dict[str, Any]]]]]]:
+        # Pack sizes are picked as the scheduler pulls tasks, so they follow the tuner
+        sample_id = 0
+        while sample_id < num_samples:
+            candidate_limit = self.client.max_candidates(model)
+            count = tuner.next_size(candidate_limit)
+            if not self.client.supports_json(model):
+                # Beyond the candidate limit packs need the JSON multi-answer prompt
+                count = min(count, candidate_limit)
+            count = min(count, num_samples - sample_id)
+            sample_ids = list(range(sample_id, sample_id + count))
+            yield partial(self._generate_packed_samples, prompt, sample_ids, model, fine_tuning_format, tuner, dedup)
+            sample_id += count
+
+    async def _generate_conversation(
+        self, prompt: str, num_turns: int, model: str, variant: Any
+    ) -> List[Dict[str, Any]]:
+        conversation = []
+        current_prompt = prompt
+
+        for turn in range(num_turns):
+            # Generate input (human message)
+            if turn == 0:
+                input_content = current_prompt
+            else:
+                input_content = await self._generate_content(current_prompt, model, variant=variant)
+
+            input_data = {"input": {"content": input_content}}
+            conversation.append(input_data)
+
+            # Generate output (AI response) based on the input
+            with metrics.stage("prompt_build"):
+                output_prompt = f"{current_prompt}\n\nHuman: {input_content}\n\nAI:"
+            output_content = await self._generate_content(output_prompt, model, variant=variant)
+            output_data = {"output": {"content": output_content}}
+            conversation.append(output_data)
+
+            # Update the prompt for the next turn
+            current_prompt = f"{output_prompt} {output_content}"
+
+        return conversation
+
+    async def _generate_structured_conversation(
+        self, prompt: str, num_turns: int, model: str, variant: Any
+    ) -> List[Dict[str, Any]]:
+        """
+        Generate a whole conversation with a single structured-output call, asking again
+        (under a fresh cache key) only when the reply does not parse.
+        """
+        with metrics.stage("prompt_build"):
+            full_prompt = STRUCTURED_DIALOGUE_PROMPT.format(num_turns=num_turns, prompt=prompt)
+            schema = dialogue_schema(num_turns)
+        max_attempts = Config.STRUCTURED_MAX_ATTEMPTS
+        for retry in range(max_attempts):
+            text = await self._generate_content(
+                full_prompt, model, variant=variant if not retry else f"{variant}:malformed{retry}",
+                response_schema=schema
+            )
+            try:
+                with metrics.stage("parse"):
+                    return parse_dialogue(text, num_turns)
+            except MalformedDialogueError as e:
+                if retry + 1 == max_attempts:
+                    raise
+                logger.warning(f"Malformed structured dialogue for variant {variant}, retrying: {e}")
+                if metrics.enabled:
+                    metrics.RETRIES.inc(model, "malformed")
+
+    async def _generate_multi_turn(
+        self, prompt: str, num_turns: int, model: str, sample_id: int, mode: str = "prompt",
+        context: Optional[ContextPolicy] = None, attempt: int = 0
+    ) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, int]]]:
+        """
+        Generate one conversation in the given multi-turn ``mode``.
+
+        ``prompt`` re-renders the whole transcript into every call; ``chat`` keeps a chat
+        session per speaker and only sends the new message, trimmed by ``context``;
+        ``structured`` gets the whole conversation as JSON from a single call. The second
+        element is the prompt-token report for modes that produce one.
+        """
+        variant = self._variant(sample_id, attempt)
+        if mode == "chat":
+            return await generate_chat_conversation(
+                self.client, prompt, num_turns, model, context, variant=variant, cache_mode=self.cache_mode
+            )
+        if mode == "structured":
+            return await self._generate_structured_conversation(prompt, num_turns, model, variant), None
+        if mode != "prompt":
+            raise ValueError(f"Invalid multi-turn mode: {mode}")
+        return await self._generate_conversation(prompt, num_turns, model, variant), None
+
+    async def _generate_conversation_for_stream(
+        self, prompt: str, num_turns: int, model: str, sample_id: int, mode: str, context: Optional[ContextPolicy],
+        attempt: int = 0
+    ) -> List[Dict[str, Any]]:
+        conversation, usage = await self._generate_multi_turn(
+            prompt, num_turns, model, sample_id, mode, context, attempt
+        )
+        if usage is not None:
+            logger.info(f"Conversation {sample_id} prompt tokens: {usage}")
+        return conversation
+
+    async def _generate_conversation_instance(
+        self, prompt: str, num_turns: int, model: str, sample_id: int, mode: str = "prompt",
+        context: Optional[ContextPolicy] = None
+    ) -> Dict[str, Any]:
+        conversation, usage = await self._generate_multi_turn(prompt, num_turns, model, sample_id, mode, context)
+        instance = {
+            "input": {"content": prompt},
+            "output": {"content": conversation}
+        }
+        if usage is not None:
+            instance["metadata"] = usage
+        return instance
+
+    async def _generate_text_dialogue(
+        self, prompt: str, num_turns: int, model: str, conversation_index: int
+    ) -> List[Dict[str, Any]]:
+        with metrics.stage("prompt_build"):
+            full_prompt = f"""Generate a {num_turns}-turn dialogue about the following topic. 
+                Each turn should start with either 'Human:' or 'AI:' and contain a complete thought or question.
+                Topic: {prompt}
+                
+                Human: {prompt}"""
+
+        full_dialogue = await self._generate_content(full_prompt, model, variant=conversation_index)
+
+        with metrics.stage("parse"):
+            turns = re.split(r'(Human:|AI:)\s*', full_dialogue)
+            turns = [turn.strip() for turn in turns if turn.strip()]
+
+            conversation = []
+            for i in range(0, len(turns) - 1, 2):
+                speaker = turns[i]
+                content = turns[i + 1]
+
+                if speaker == "Human:":
+                    turn_data = {"input": {"content": content}}
+                elif speaker == "AI:":
+                    turn_data = {"output": {"content": content}}
+                else:
+                    logger.warning(f"Unexpected speaker in conversation {conversation_index + 1}: {speaker}")
+                    continue
+
+                conversation.append(turn_data)
+        return conversation
+
+    async def generate_dialogue(
+        self, prompt: str, num_turns: int, model: str, conversation_index: int, mode: str = "text"
+    ) -> Dict[str, Any]:
+        """
+        Generate a whole ``num_turns`` dialogue with a single model call and return it
+        in the fine-tuning ``messages`` format. ``text`` parses a free-text
+        ``Human:``/``AI:`` transcript; ``structured`` asks for JSON and retries replies
+        that do not parse.
+        """
+        if mode == "structured":
+            conversation = await self._generate_structured_conversation(prompt, num_turns, model, conversation_index)
+        elif mode == "text":
+            conversation = await self._generate_text_dialogue(prompt, num_turns, model, conversation_index)
+        else:
+            raise ValueError(f"Invalid dialogue mode: {mode}")
+
+        with metrics.stage("format"):
+            return self._format_for_fine_tuning({
+                "conversation": conversation,
+                "metadata": {
+                    "num_turns": num_turns,
+                    "model": model,
+                    "conversation_index": conversation_index
+                }
+            })
+
+    async def _generate_batch_instance(
+        self, spec: Dict[str, Any], sample_id: int, model: str, fine_tuning_format: bool
+    ) -> Tuple[int, Dict[str, Any]]:
+        if spec["num_turns"]:
+            instance = await self._generate_conversation_instance(
+                spec["prompt"], spec["num_turns"], model, sample_id, spec["mode"],
+                ContextPolicy.from_dict(spec["context"])
+            )
+        else:
+            instance = await self._generate_single_turn_sample(spec["prompt"], sample_id, model, fine_tuning_format)
+        return sample_id, instance
+
+    def _batch_request_tasks(
+        self, spec: Dict[str, Any], model: str, fine_tuning_format: bool, skip: Container[int] = ()
+    ) -> Iterator[Callable[[], Awaitable[Tuple[int, Dict[str, Any]]]]]:
+        for sample_id in range(spec["num_samples"]):
+            if sample_id not in skip:
+                yield partial(self._generate_batch_instance, spec, sample_id, model, fine_tuning_format)
+
+    @staticmethod
+    def _batch_request_spec(request: Union[Dict[str, Any], Any]) -> Dict[str, Any]:
+        if not isinstance(request, dict):
+            request = {
+                "prompt": request.prompt,
+                "num_samples": request.num_samples,
+                "num_turns": getattr(request, "num_turns", None),
+                "mode": getattr(request, "mode", None),
+                "context": getattr(request, "context", None),
+            }
+        return {
+            "prompt": request.get("prompt"),
+            "num_samples": request.get("num_samples"),
+            "num_turns": request.get("num_turns"),
+            "mode": request.get("mode") or "prompt",
+            "context": request.get("context"),
+        }
+
     async def generate_single_turn_dataset_stream(
-        self, prompt: str, num_samples: int, model: str, fine_tuning_format: bool, output_file: str
+        self, prompt: str, num_samples: int, model: str, fine_tuning_format: bool, output_file: str,
+        ordered: bool = False, dedup: Optional["NearDuplicateFilter"] = None,
+        writer: Optional[ShardedDatasetWriter] = None, index: bool = False,
+        samples_per_call: Union[int, str, None] = None
     ) -> AsyncGenerator[str, None]:
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)  # Create output directory if it doesn't exist
-        async with aiofiles.open(output_file, mode='w') as f:
-            for i in range(num_samples):
-                response = await self._generate_content(prompt, model)
-                data = {
-                    "prompt": prompt,
-                    "response": response,
-                    "metadata": {"sample_id": i, "model": model}
-                }
-                if fine_tuning_format:
+        """
+        Generate ``num_samples`` single-turn samples concurrently.
+
+        Lines are yielded (and written to ``output_file``) as samples complete, or in
+        ``sample_id`` order when ``ordered`` is set. Near-duplicates of earlier samples
+        are dropped (or regenerated) when a ``dedup`` filter is given. With a ``writer``,
+        records go to its shards instead of ``output_file``; the caller closes it. With
+        ``index`` set, an offset index for ``DatasetReader`` is written next to
+        ``output_file``.
+
+        ``samples_per_call`` packs several samples into each upstream call: a number
+        fixes the pack size and ``"auto"`` tunes it (see ``PackingTuner``).
+        """
+        if writer is None:
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)  # Create output directory if it doesn't exist
+        if samples_per_call in (None, 1):
+            samples = (
+                partial(
+                    self._generate_deduplicated,
+                    partial(self._generate_single_turn_sample, prompt, i, model, fine_tuning_format),
+                    dedup, model
+                )
+                for i in range(num_samples)
+            )
+        else:
+            samples = self._packed_sample_tasks(
+                prompt, num_samples, model, fine_tuning_format, PackingTuner.from_setting(samples_per_call), dedup
+            )
+        async with aclosing(self._stream_records(samples, output_file, ordered, dedup, writer, index)) as lines:
+            async for json_data in lines:
+                yield json_data
+
+    async def _stream_records(
+        self, samples: Iterable[Callable[[], Awaitable[Any]]], output_file: Optional[str], ordered: bool,
+        dedup: Optional["NearDuplicateFilter"], writer: Optional[ShardedDatasetWriter], index: bool
+    ) -> AsyncGenerator[str, None]:
+        # Tasks may return one record, a list of records (packed samples) or None (dropped duplicates).
+        # Records go to the writer if given, else to output_file if given, and are always yielded.
+        f = None
+        offsets = None
+        try:
+            if writer is None and output_file is not None:
+                f = await aiofiles.open(output_file, mode='w', encoding='utf-8')
+                if index:
+                    from src.dataset_index import OffsetIndexWriter
+                    offsets = OffsetIndexWriter(output_file)
+            async for _, _, result in self.scheduler.run([samples], ordered=ordered):
+                for data in result if isinstance(result, list) else (result,):
+                    if data is None:
+                        continue
+                    with metrics.stage("format"):
+                        json_data = json.dumps(data) + "\n"
+                    with metrics.stage("write"):
+                        if f is not None:
+                            await f.write(json_data)
+                            if offsets is not None:
+                                offsets.add(len(json_data.encode("utf-8")), data)
+                        elif writer is not None:
+                            await writer.write(json_data if writer.output_format == "jsonl" else data)
+                    yield json_data
+            if writer is not None:
+                await writer.flush()
+        finally:
+            if f is not None:
+                await f.close()
+            if offsets is not None:
+                offsets.close()
+            if dedup is not None:
+                dedup.flush()
+
+    async def _generate_template_sample(
+        self, prompt: str, variables: Dict[str, Any], sample_id: int, model: str, fine_tuning_format: bool,
+        num_turns: Optional[int], mode: str, context: Optional[ContextPolicy], attempt: int = 0
+    ) -> Dict[str, Any]:
+        if num_turns:
+            conversation, _ = await self._generate_multi_turn(
+                prompt, num_turns, model, sample_id, mode, context, attempt
+            )
+            data = {
+                "conversation": conversation,
+                "metadata": {"num_turns": num_turns, "model": model, "sample_id": sample_id}
+            }
+            if fine_tuning_format:
+                with metrics.stage("format"):
                     data = self._format_for_fine_tuning(data)
-                json_data = json.dumps(data) + "\n"
-                await f.write(json_data)
+        else:
+            data = await self._generate_single_turn_sample(prompt, sample_id, model, fine_tuning_format, attempt)
+        data["metadata"]["template"] = variables
+        return data
+
+    async def generate_template_dataset_stream(
+        self, template: PromptTemplate, num_samples: Optional[int], model: str, fine_tuning_format: bool,
+        output_file: str, sampling: str = "product", seed: Optional[int] = 0, num_turns: Optional[int] = None,
+        mode: str = "prompt", context: Optional[ContextPolicy] = None, ordered: bool = False,
+        dedup: Optional["NearDuplicateFilter"] = None, writer: Optional[ShardedDatasetWriter] = None,
+        index: bool = False
+    ) -> AsyncGenerator[str, None]:
+        """
+        Generate one sample per prompt drawn from ``template`` (see ``PromptTemplate.sample``
+        for ``sampling``), as single-turn samples or, with ``num_turns``, conversations.
+
+        Prompts are expanded lazily as the scheduler pulls tasks, so the number of
+        combinations does not affect memory use. Every record carries its template
+        variables in ``metadata["template"]``. The remaining arguments are as for
+        ``generate_single_turn_dataset_stream``.
+        """
+        if writer is None:
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        samples = (
+            partial(
+                self._generate_deduplicated,
+                partial(
+                    self._generate_template_sample, prompt, variables, i, model, fine_tuning_format, num_turns, mode,
+                    context
+                ),
+                dedup, model
+            )
+            for i, (prompt, variables) in enumerate(template.sample(num_samples, sampling, seed))
+        )
+        async with aclosing(self._stream_records(samples, output_file, ordered, dedup, writer, index)) as lines:
+            async for json_data in lines:
                 yield json_data
-                await asyncio.sleep(0.1)  # Rate limiting
 
     async def generate_multi_turn_dataset_stream(
-        self, prompt: str, num_turns: int, num_samples: int, model: str, fine_tuning_format: bool, output_file: str
+        self, prompt: str, num_turns: int, num_samples: int, model: str, fine_tuning_format: bool, output_file: str,
+        ordered: bool = False, mode: str = "prompt", context: Optional[ContextPolicy] = None,
+        dedup: Optional["NearDuplicateFilter"] = None, writer: Optional[ShardedDatasetWriter] = None
     ) -> AsyncGenerator[str, None]:
-        for _ in range(num_samples):
-            conversation = []
-            current_prompt = prompt
-
-            for turn in range(num_turns):
-                # Generate input (human message)
-                if turn == 0:
-                    input_content = current_prompt
-                else:
-                    input_content = await self._generate_content(current_prompt, model)
-                
-                input_data = {"input": {"content": input_content}}
-                conversation.append(input_data)
-                
-                # Generate output (AI response) based on the input
-                output_prompt = f"{current_prompt}\n\nHuman: {input_content}\n\nAI:"
-                output_content = await self._generate_content(output_prompt, model)
-                output_data = {"output": {"content": output_content}}
-                conversation.append(output_data)
-                
-                # Update the prompt for the next turn
-                current_prompt = f"{output_prompt} {output_content}"
+        """
+        Generate ``num_samples`` conversations concurrently. See ``_generate_multi_turn``
+        for the available ``mode`` values and ``generate_single_turn_dataset_stream`` for
+        ``dedup`` and ``writer``. Without a ``writer`` the conversations are only yielded.
+        """
+        async def generate_conversation(i: int) -> List[Optional[List[Dict[str, Any]]]]:
+            # A conversation is itself a list of turns; wrap it so it is written as one record
+            return [await self._generate_deduplicated(
+                partial(self._generate_conversation_for_stream, prompt, num_turns, model, i, mode, context),
+                dedup, model
+            )]
 
-            yield json.dumps(conversation) + "\n"
+        conversations = (partial(generate_conversation, i) for i in range(num_samples))
+        async with aclosing(self._stream_records(conversations, None, ordered, dedup, writer, False)) as lines:
+            async for json_data in lines:
+                yield json_data
 
     async def generate_batch_dataset(
-        self, requests: List[Union[Dict[str, Any], Any]], output_file: str, model: str, fine_tuning_format: bool
+        self, requests: List[Union[Dict[str, Any], Any]], output_file: str, model: str, fine_tuning_format: bool,
+        checkpoint_dir: Optional[str] = None, writer: Optional[ShardedDatasetWriter] = None
     ):
+        """
+        Generate every request of a batch concurrently, checkpointing each instance.
+
+        Samples of all requests share the scheduler's concurrency cap and are scheduled
+        round-robin across requests. Every finished instance is appended to a
+        ``BatchCheckpoint`` in ``checkpoint_dir`` (default: ``<output_file>.checkpoint``),
+        so rerunning the same batch only generates the missing samples. Once all samples
+        are done the checkpoint is compacted into ``output_file``.
+
+        Multi-turn requests may set ``mode`` and ``context`` (``ContextPolicy`` keyword
+        arguments) to choose how conversations are generated.
+
+        With a ``writer``, the checkpoint is compacted into its shards instead, one
+        ``{"request_id", "sample_id", "instance"}`` record per instance in request and
+        sample order.
+        """
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        async with aiofiles.open(output_file, mode='w') as f:
-            for idx, request in enumerate(requests):
-                if isinstance(request, dict):
-                    prompt = request.get("prompt")
-                    num_samples = request.get("num_samples")
-                    num_turns = request.get("num_turns")
-                else:
-                    prompt = request.prompt
-                    num_samples = request.num_samples
-                    num_turns = getattr(request, "num_turns", None)
+        specs = [self._batch_request_spec(request) for request in requests]
+        batch = [
+            {
+                "id": idx,
+                "model": model,
+                "metadata": {"num_turns": spec["num_turns"] if spec["num_turns"] else 1}
+            }
+            for idx, spec in enumerate(specs)
+        ]
 
-                model_data = {
-                    "id": idx,
-                    "model": model,
-                    "instances": [],
-                    "metadata": {"num_turns": num_turns if num_turns else 1}
-                }
+        fingerprint = BatchCheckpoint.batch_fingerprint(
+            [dict(spec, model=model) for spec in specs], fine_tuning_format
+        )
+        checkpoint = BatchCheckpoint(checkpoint_dir or f"{output_file}.checkpoint", fingerprint)
+        # Checkpoint reads and writes below run off the event loop, which may be serving other requests
+        completed = await asyncio.to_thread(checkpoint.load)
 
-                if num_turns:
-                    async for conversation_data in self.generate_multi_turn_dataset_stream(
-                        prompt, num_turns, num_samples, model, fine_tuning_format, output_file
-                    ):
-                        conversation = json.loads(conversation_data)
-                        model_data["instances"].append({
-                            "input": {"content": prompt},
-                            "output": {"content": conversation}
-                        })
-                else:
-                    async for data in self.generate_single_turn_dataset_stream(
-                        prompt, num_samples, model, fine_tuning_format, output_file
-                    ):
-                        instance = json.loads(data)
-                        model_data["instances"].append(instance)
+        done: Dict[int, Set[int]] = {}
+        for request_id, sample_id in completed:
+            done.setdefault(request_id, set()).add(sample_id)
+        sources = [
+            self._batch_request_tasks(spec, model, fine_tuning_format, skip=done.get(idx, ()))
+            for idx, spec in enumerate(specs)
+        ]
+
+        async with checkpoint:
+            async for idx, _, (sample_id, instance) in self.scheduler.run(sources):
+                with metrics.stage("write"):
+                    await checkpoint.append(idx, sample_id, instance)
+                completed.add((idx, sample_id))
 
-                await f.write(json.dumps(model_data, indent=4) + '\n')
+        if writer is None:
+            await asyncio.to_thread(checkpoint.compact, output_file, batch, completed)
+            return
+        entries = checkpoint.entries(completed)
+        while True:
+            chunk = await asyncio.to_thread(list, islice(entries, 256))
+            if not chunk:
+                break
+            for entry in chunk:
+                await writer.write(entry)
+        await writer.flush()
 
     def _format_for_fine_tuning(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -113,7 +599,11 @@ class DatasetGenerator:
         formatted_data = {
             "messages": []
         }
-        for turn in data["conversation"]:
+        conversation = data.get("conversation")
+        if conversation is None:
+            # Single-turn samples carry a prompt/response pair instead of a conversation
+            conversation = [{"input": {"content": data["prompt"]}}, {"output": {"content": data["response"]}}]
+        for turn in conversation:
             if "input" in turn:
                 formatted_data["messages"].append({
                     "role": "user",
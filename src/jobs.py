@@ -0,0 +1,314 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from functools import partial
+from typing import Any, Dict, List, Optional, Set, Tuple
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    request TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    run_started_at REAL,
+    run_base INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    owner TEXT,
+    lease_expires REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    conversation_index INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq),
+    UNIQUE (job_id, conversation_index)
+);
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class JobLeaseLost(Exception):
+    pass
+
+
+class JobStore:
+    """
+    SQLite-backed store for generation jobs and their results.
+
+    Several ``JobManager``s (e.g. one per server worker process) may share a store: a
+    job is run by the manager that claimed it, for as long as it keeps renewing its
+    lease. All methods are blocking; ``JobManager`` calls them through
+    ``asyncio.to_thread``.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        with self._conn:
+            # Stores created before jobs had owners
+            for column, column_type in (("owner", "TEXT"), ("lease_expires", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def create_job(self, request: Dict[str, Any], total: int) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, request, total, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(request), total, time.time())
+            )
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["request"] = json.loads(job["request"])
+        return job
+
+    def claimable_jobs(self) -> List[str]:
+        """Queued jobs and running jobs whose owner stopped renewing its lease."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY created_at",
+                (QUEUED, RUNNING, time.time())
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def claim_job(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Mark a claimable job as running under ``owner``; ``False`` if another owner has it."""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, lease_expires = ?, started_at = COALESCE(started_at, ?), "
+                "run_started_at = ?, run_base = completed "
+                "WHERE id = ? AND (status = ? OR (status = ? AND lease_expires < ?))",
+                (RUNNING, owner, now + lease_seconds, now, now, job_id, QUEUED, RUNNING, now)
+            )
+        return cursor.rowcount == 1
+
+    def renew_leases(self, owner: str, lease_seconds: float):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE owner = ? AND status = ?",
+                (time.time() + lease_seconds, owner, RUNNING)
+            )
+
+    def mark_finished(self, job_id: str, owner: str, status: str, error: Optional[str] = None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ?, lease_expires = NULL "
+                "WHERE id = ? AND owner = ? AND status = ?",
+                (status, time.time(), error, job_id, owner, RUNNING)
+            )
+
+    def release_job(self, job_id: str, owner: str):
+        """Hand a running job back to the queue, e.g. when its manager shuts down."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, lease_expires = NULL WHERE id = ? AND owner = ? AND status = ?",
+                (QUEUED, job_id, owner, RUNNING)
+            )
+
+    def completed_indexes(self, job_id: str) -> Set[int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT conversation_index FROM results WHERE job_id = ?", (job_id,)
+            ).fetchall()
+        return {row["conversation_index"] for row in rows}
+
+    def add_result(self, job_id: str, owner: str, conversation_index: int, record: str, is_error: bool):
+        with self._lock, self._conn:
+            # Read seq under the write lock, so concurrent writers cannot pick the same one
+            self._conn.execute("BEGIN IMMEDIATE")
+            job = self._conn.execute("SELECT completed, owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job["owner"] != owner:
+                raise JobLeaseLost(f"Job {job_id} was taken over by {job['owner']}")
+            seq = job["completed"]
+            self._conn.execute(
+                "INSERT INTO results (job_id, seq, conversation_index, record) VALUES (?, ?, ?, ?)",
+                (job_id, seq, conversation_index, record)
+            )
+            self._conn.execute(
+                "UPDATE jobs SET completed = completed + 1, errors = errors + ? WHERE id = ?",
+                (int(is_error), job_id)
+            )
+
+    def get_results(self, job_id: str, offset: int, limit: int) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT record FROM results WHERE job_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (job_id, offset, offset + limit)
+            ).fetchall()
+        return [row["record"] for row in rows]
+
+
+class JobManager:
+    """
+    Run queued generation jobs on a bounded pool of worker tasks.
+
+    Every finished conversation is committed to the ``JobStore`` immediately, so a job
+    interrupted by a restart is picked up again and only generates the conversations
+    that are still missing.
+
+    Managers sharing a store (one per server worker process) claim each job before
+    running it and renew the leases of their jobs every ``lease_seconds / 3``. Every
+    manager periodically looks for queued jobs and for jobs whose owner stopped
+    renewing (it crashed), so no job is run twice or left behind.
+    """
+
+    def __init__(
+        self, generator, store: JobStore, max_workers: Optional[int] = None, lease_seconds: Optional[float] = None
+    ):
+        self.generator = generator
+        self.store = store
+        self.max_workers = max_workers or Config.MAX_CONCURRENT_JOBS
+        self.lease_seconds = lease_seconds or Config.JOB_LEASE_SECONDS
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._queued: Set[str] = set()
+        self._running: Set[str] = set()
+        self._workers: List[asyncio.Task] = []
+
+    def _enqueue(self, job_id: str):
+        if job_id not in self._queued and job_id not in self._running:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _maintain(self):
+        while True:
+            await asyncio.to_thread(self.store.renew_leases, self.owner, self.lease_seconds)
+            for job_id in await asyncio.to_thread(self.store.claimable_jobs):
+                self._enqueue(job_id)
+            await asyncio.sleep(self.lease_seconds / 3)
+
+    async def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+        self._workers.append(asyncio.create_task(self._maintain()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Jobs cut short here are picked up by another manager, or by this one after a restart
+        for job_id in list(self._running):
+            await asyncio.to_thread(self.store.release_job, job_id, self.owner)
+        self._running.clear()
+
+    async def submit(self, request: Dict[str, Any]) -> str:
+        job_id = await asyncio.to_thread(self.store.create_job, request, request["num_conversations"])
+        self._enqueue(job_id)
+        return job_id
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def get_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None:
+            return None
+        if job["status"] == RUNNING and job["run_started_at"]:
+            elapsed = time.time() - job["run_started_at"]
+        elif job["finished_at"] and job["run_started_at"]:
+            elapsed = job["finished_at"] - job["run_started_at"]
+        else:
+            elapsed = 0.0
+        processed = job["completed"] - job["run_base"]
+        return {
+            "id": job["id"],
+            "status": job["status"],
+            "request": job["request"],
+            "total": job["total"],
+            "completed": job["completed"],
+            "errors": job["errors"],
+            "progress": job["completed"] / job["total"] if job["total"] else 1.0,
+            "throughput": processed / elapsed if elapsed > 0 else 0.0,
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "error": job["error"],
+        }
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                if not await asyncio.to_thread(self.store.claim_job, job_id, self.owner, self.lease_seconds):
+                    continue
+                self._running.add(job_id)
+                await self._run_job(job_id)
+                self._running.discard(job_id)
+            except asyncio.CancelledError:
+                raise
+            except JobLeaseLost as e:
+                self._running.discard(job_id)
+                logger.warning(str(e))
+            except Exception as e:
+                self._running.discard(job_id)
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                await asyncio.to_thread(self.store.mark_finished, job_id, self.owner, FAILED, str(e))
+            finally:
+                self._queue.task_done()
+
+    async def _generate_record(self, request: Dict[str, Any], conversation_index: int) -> Tuple[int, Dict[str, Any]]:
+        try:
+            record = await self.generator.generate_dialogue(
+                request["prompt"], request["num_turns"], request["model"], conversation_index,
+                request.get("mode", "text")
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error during generation of conversation {conversation_index + 1}: {str(e)}")
+            record = {"error": f"Error in conversation {conversation_index + 1}: {str(e)}"}
+        return conversation_index, record
+
+    async def _run_job(self, job_id: str):
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        request = job["request"]
+        done = await asyncio.to_thread(self.store.completed_indexes, job_id)
+
+        conversations = (
+            partial(self._generate_record, request, conversation_index)
+            for conversation_index in range(job["total"])
+            if conversation_index not in done
+        )
+        async for _, _, (conversation_index, record) in self.generator.scheduler.run([conversations]):
+            await asyncio.to_thread(
+                self.store.add_result, job_id, self.owner, conversation_index, json.dumps(record), "error" in record
+            )
+        await asyncio.to_thread(self.store.mark_finished, job_id, self.owner, COMPLETED)
@@ -0,0 +1,194 @@
+import math
+import time
+import threading
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Dict, List, Sequence, Tuple
+from src.config import Config
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Every hook checks this flag first, so disabled metrics cost one attribute lookup
+enabled = Config.METRICS_ENABLED
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _samples(self) -> List[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        with self._lock:
+            return [(self.name, self.labelnames, labels, value) for labels, value in sorted(self._values.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labelnames, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts followed by the sum and the count
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def _samples(self):
+        samples = []
+        labelnames = self.labelnames + ("le",)
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", labelnames, labels + (_format_value(bound),), cumulative))
+                samples.append((f"{self.name}_sum", self.labelnames, labels, series[-2]))
+                samples.append((f"{self.name}_count", self.labelnames, labels, series[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = MetricsRegistry()
+
+UPSTREAM_LATENCY = registry.histogram(
+    "dataset_generator_upstream_latency_seconds", "Latency of model backend calls.", ("model", "call")
+)
+UPSTREAM_REQUESTS = registry.counter(
+    "dataset_generator_upstream_requests_total", "Model backend calls.", ("model", "call")
+)
+UPSTREAM_ERRORS = registry.counter(
+    "dataset_generator_upstream_errors_total", "Failed model backend calls.", ("model", "call", "status")
+)
+UPSTREAM_IN_FLIGHT = registry.gauge(
+    "dataset_generator_upstream_in_flight", "Model backend calls in progress.", ("model",)
+)
+RETRIES = registry.counter(
+    "dataset_generator_retries_total", "Generation attempts repeated, by reason.", ("model", "reason")
+)
+CONCURRENCY_LIMIT = registry.gauge(
+    "dataset_generator_concurrency_limit", "Adaptive concurrency limit per model.", ("model",)
+)
+CIRCUIT_OPEN = registry.gauge(
+    "dataset_generator_circuit_open", "Whether the circuit breaker of a model is open.", ("model",)
+)
+TOKENS = registry.counter(
+    "dataset_generator_tokens_total", "Tokens reported by the model backend.", ("model", "direction")
+)
+SCHEDULER_IN_FLIGHT = registry.gauge(
+    "dataset_generator_scheduler_in_flight", "Generation tasks running under a scheduler."
+)
+SCHEDULER_QUEUED = registry.gauge(
+    "dataset_generator_scheduler_queued", "Generation tasks waiting for a scheduler slot."
+)
+JOBS_QUEUED = registry.gauge("dataset_generator_jobs_queued", "Background jobs waiting for a worker.")
+STAGE_SECONDS = registry.histogram(
+    "dataset_generator_stage_seconds", "Time spent per generation stage.", ("stage",)
+)
+CACHE = registry.gauge("dataset_generator_response_cache", "Response cache statistics.", ("stat",))
+
+
+class _StageTimer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, self.stage)
+
+
+_DISABLED = nullcontext()
+
+
+def stage(name: str):
+    """
+    Time a block as one of the generation stages: ``prompt_build``, ``model_call``,
+    ``parse``, ``format`` or ``write``.
+    """
+    return _StageTimer(name) if enabled else _DISABLED
@@ -0,0 +1,93 @@
+import json
+from typing import Any, Dict, List, Optional, Union
+from src.config import Config
+
+MULTI_ANSWER_PROMPT = (
+    "Answer the prompt below {count} times, independently, as if it had been asked in {count} separate "
+    "conversations. Each answer must stand on its own and should differ from the others. Return JSON with an "
+    "\"answers\" array of exactly {count} strings.\n\nPrompt: {prompt}"
+)
+
+
+class MalformedAnswersError(ValueError):
+    pass
+
+
+def answers_schema(count: int) -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            "answers": {"type": "array", "min_items": count, "max_items": count, "items": {"type": "string"}}
+        },
+        "required": ["answers"],
+    }
+
+
+def parse_answers(text: str, count: int) -> List[str]:
+    """Parse a multi-answer reply, raising ``MalformedAnswersError`` unless it holds ``count`` non-empty answers."""
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise MalformedAnswersError(f"Answers are not valid JSON: {e}") from e
+    answers = data.get("answers") if isinstance(data, dict) else None
+    if not isinstance(answers, list) or len(answers) != count:
+        raise MalformedAnswersError(
+            f"Expected {count} answers, got {len(answers) if isinstance(answers, list) else 0}"
+        )
+    if not all(isinstance(answer, str) and answer.strip() for answer in answers):
+        raise MalformedAnswersError("Answers must be non-empty strings")
+    return [answer.strip() for answer in answers]
+
+
+class PackingTuner:
+    """
+    Choose how many samples to request per upstream call.
+
+    With ``adaptive`` set, the pack size grows by one after every successful packed call
+    while the recent failure rate stays below ``max_failure_rate``, and halves after a
+    failed one. Samples that share one response (the multi-answer prompt, used beyond
+    the model's candidate limit) are also capped so that the pack's expected length,
+    from the average sample length seen so far, stays within ``headroom`` of
+    ``max_output_tokens``.
+    """
+
+    def __init__(self, max_samples: int = 8, initial: int = 2, adaptive: bool = True,
+                 max_output_tokens: Optional[int] = None, max_failure_rate: float = 0.2,
+                 headroom: float = 0.8, smoothing: float = 0.2):
+        self.max_samples = max_samples
+        self.size = max(1, min(initial, max_samples))
+        self.adaptive = adaptive
+        self.max_output_tokens = max_output_tokens or Config.PACKING_MAX_OUTPUT_TOKENS
+        self.max_failure_rate = max_failure_rate
+        self.headroom = headroom
+        self.smoothing = smoothing
+        self.sample_tokens: Optional[float] = None
+        self.failure_rate = 0.0
+
+    @classmethod
+    def from_setting(cls, samples_per_call: Union[int, str]) -> "PackingTuner":
+        """``"auto"`` tunes the pack size up to ``PACKING_MAX_SAMPLES``; a number fixes it."""
+        if samples_per_call == "auto":
+            return cls(Config.PACKING_MAX_SAMPLES)
+        return cls(int(samples_per_call), initial=int(samples_per_call), adaptive=False)
+
+    def next_size(self, candidate_limit: int) -> int:
+        if not self.adaptive or self.sample_tokens is None or self.size <= candidate_limit:
+            return self.size
+        length_limit = int(self.max_output_tokens * self.headroom / max(self.sample_tokens, 1))
+        return max(1, min(self.size, max(candidate_limit, length_limit)))
+
+    def record_success(self, responses: List[str]):
+        tokens = sum((len(response) + 3) // 4 for response in responses) / len(responses)
+        if self.sample_tokens is None:
+            self.sample_tokens = tokens
+        else:
+            self.sample_tokens += self.smoothing * (tokens - self.sample_tokens)
+        self.failure_rate *= 1 - self.smoothing
+        if self.adaptive and self.failure_rate < self.max_failure_rate:
+            self.size = min(self.max_samples, self.size + 1)
+
+    def record_failure(self):
+        self.failure_rate += self.smoothing * (1 - self.failure_rate)
+        if self.adaptive:
+            self.size = max(1, self.size // 2)
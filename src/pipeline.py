@@ -0,0 +1,268 @@
+import os
+import json
+import asyncio
+import inspect
+import logging
+import textwrap
+from functools import partial
+from typing import Any, Awaitable, Callable, Iterator, List, Optional, Union
+from src.scheduler import GenerationScheduler
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = " \t\r\n"
+# Characters that may continue a JSON number
+_NUMBER_CHARS = "0123456789.eE+-"
+
+
+def _detect_format(path: str) -> str:
+    return "jsonl" if path.endswith(".jsonl") else "json"
+
+
+def _iter_jsonl(path: str) -> Iterator[Any]:
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.error(f"Failed to parse JSON from line {line_number} of {path}")
+
+
+def _iter_json(path: str, chunk_size: int) -> Iterator[Any]:
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buffer = ""
+        eof = False
+        in_array = None
+
+        def fill(minimum: int) -> bool:
+            nonlocal buffer, eof
+            while not eof and len(buffer) < minimum:
+                chunk = f.read(max(chunk_size, minimum - len(buffer)))
+                if not chunk:
+                    eof = True
+                buffer += chunk
+            return bool(buffer)
+
+        while True:
+            # Skip whitespace (and array separators) until the next value starts
+            while True:
+                if not buffer and not fill(1):
+                    break
+                stripped = buffer.lstrip(_WHITESPACE + ("," if in_array else ""))
+                if stripped:
+                    buffer = stripped
+                    break
+                buffer = ""
+            if not buffer:
+                if in_array:
+                    raise ValueError(f"Unterminated JSON array in {path}")
+                return
+            if in_array is None:
+                in_array = buffer[0] == "["
+                if in_array:
+                    buffer = buffer[1:]
+                    continue
+            if in_array and buffer[0] == "]":
+                return
+
+            # Decode one value, reading more input (doubling the request) until it is complete
+            wanted = len(buffer)
+            while True:
+                try:
+                    record, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    wanted = max(wanted * 2, chunk_size)
+                    fill(wanted)
+                    continue
+                # A number cut off by the end of the buffer decodes as its prefix ("2." as 2);
+                # it is complete only once a character follows that cannot continue it
+                if (
+                    not eof and isinstance(record, (int, float))
+                    and (end == len(buffer) or buffer[end] in _NUMBER_CHARS)
+                ):
+                    fill(len(buffer) + 1)
+                    continue
+                break
+            buffer = buffer[end:]
+            yield record
+
+
+def iter_records(path: str, input_format: Optional[str] = None, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Incrementally parse records from ``path`` without loading the whole file.
+
+    ``jsonl`` reads one record per line and skips (and logs) malformed lines. ``json``
+    accepts a top-level array as well as a stream of concatenated, possibly
+    pretty-printed documents such as ``batch_output.json``. The format is picked from
+    the file extension when not given.
+    """
+    input_format = input_format or _detect_format(path)
+    if input_format == "jsonl":
+        return _iter_jsonl(path)
+    if input_format == "json":
+        return _iter_json(path, chunk_size)
+    raise ValueError(f"Invalid input format: {input_format}")
+
+
+class StreamingWriter:
+    """
+    Write records one at a time as JSONL, or as a JSON array laid out exactly like
+    ``json.dump(records, f, indent=indent)``. The file is written under a temporary name
+    and moved into place on ``close``.
+    """
+
+    def __init__(self, path: str, output_format: Optional[str] = None, indent: Optional[int] = 2):
+        self.path = path
+        self.output_format = output_format or _detect_format(path)
+        if self.output_format not in ("json", "jsonl"):
+            raise ValueError(f"Invalid output format: {self.output_format}")
+        self.indent = indent
+        self.count = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._temp_path = f"{path}.tmp"
+        self._file = open(self._temp_path, "w", encoding="utf-8")
+
+    def write(self, record: Any):
+        if self.output_format == "jsonl":
+            self._file.write(json.dumps(record) + "\n")
+        else:
+            self._file.write(",\n" if self.count else "[\n")
+            self._file.write(textwrap.indent(json.dumps(record, indent=self.indent), " " * (self.indent or 0)))
+        self.count += 1
+
+    def close(self):
+        if self.output_format == "json":
+            self._file.write("\n]" if self.count else "[]")
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._temp_path)
+
+
+class Stage:
+    """
+    A transform step of a ``Pipeline``. ``process`` returns the (possibly modified)
+    record, or ``None`` to drop it.
+    """
+
+    async def open(self, pipeline: "Pipeline"):
+        pass
+
+    async def process(self, record: Any) -> Optional[Any]:
+        return record
+
+    async def close(self):
+        pass
+
+
+class FunctionStage(Stage):
+    """Adapt a plain sync or async ``record -> record | None`` callable into a ``Stage``."""
+
+    def __init__(self, function: Callable[[Any], Union[Any, Awaitable[Any]]]):
+        self.function = function
+
+    async def process(self, record: Any) -> Optional[Any]:
+        result = self.function(record)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+
+class HttpGenerateStage(Stage):
+    """
+    Replace ``instance["output"]`` of every instance in a batch record with the JSON
+    returned by POSTing ``{"prompt": instance["input"]["content"]}`` to ``url``, using the
+    pipeline's shared connection pool.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.session = None
+
+    async def open(self, pipeline: "Pipeline"):
+        self.session = await pipeline.http_session()
+        self.requests = pipeline.request_limit
+
+    async def _process_instance(self, instance: dict) -> dict:
+        async with self.requests:
+            async with self.session.post(self.url, json={"prompt": instance["input"]["content"]}) as response:
+                if response.status == 200:
+                    instance["output"] = await response.json()
+                else:
+                    logger.error(f"Error processing instance: {response.status}")
+                    instance["output"] = {"error": f"HTTP {response.status}"}
+        return instance
+
+    async def process(self, record: Any) -> Optional[Any]:
+        record["instances"] = list(await asyncio.gather(
+            *(self._process_instance(instance) for instance in record["instances"])
+        ))
+        return record
+
+
+class Pipeline:
+    """
+    Stream records from a file through transform stages into a ``StreamingWriter``.
+
+    At most ``max_in_flight`` records are being processed at once and output keeps the
+    input order, so memory stays bounded by the window regardless of the input size.
+    Stages that talk HTTP share one connection pool capped at ``max_requests``
+    concurrent requests.
+    """
+
+    def __init__(self, stages: Optional[List[Union[Stage, Callable]]] = None, max_in_flight: int = 64,
+                 max_requests: Optional[int] = None):
+        self.stages = [stage if isinstance(stage, Stage) else FunctionStage(stage) for stage in stages or []]
+        self.max_in_flight = max_in_flight
+        self.max_requests = max_requests or max_in_flight
+        self.request_limit = asyncio.Semaphore(self.max_requests)
+        self._session = None
+
+    async def http_session(self):
+        if self._session is None:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_requests))
+        return self._session
+
+    async def _process(self, record: Any) -> Optional[Any]:
+        for stage in self.stages:
+            record = await stage.process(record)
+            if record is None:
+                return None
+        return record
+
+    async def run(
+        self, input_path: str, output_path: str, input_format: Optional[str] = None,
+        output_format: Optional[str] = None, indent: Optional[int] = 2
+    ) -> int:
+        """Process ``input_path`` into ``output_path`` and return the number of records written."""
+        writer = StreamingWriter(output_path, output_format, indent)
+        try:
+            for stage in self.stages:
+                await stage.open(self)
+            records = (partial(self._process, record) for record in iter_records(input_path, input_format))
+            scheduler = GenerationScheduler(self.max_in_flight, buffer_factor=1)
+            async for _, _, record in scheduler.run([records], ordered=True):
+                if record is not None:
+                    writer.write(record)
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            for stage in self.stages:
+                await stage.close()
+            if self._session is not None:
+                await self._session.close()
+                self._session = None
+        writer.close()
+        return writer.count
@@ -0,0 +1,296 @@
+import time
+import random
+import asyncio
+import logging
+from typing import Dict, Optional
+from src import metrics
+from src.backends import BackendError, ModelResponse
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITED = 429
+SERVER_ERRORS = (500, 502, 503, 504)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def parse_model_limits(value: Optional[str]) -> Dict[str, float]:
+    """
+    Parse a per-model limit setting: either a single number applied to every model
+    (``"60"``) or ``model=value`` pairs (``"gemini-pro=60,gemini-1.5-flash=1000"``).
+    The default for unlisted models is stored under ``"*"``.
+    """
+    limits: Dict[str, float] = {}
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        model, separator, limit = item.rpartition("=")
+        limits[model.strip() if separator else "*"] = float(limit)
+    return limits
+
+
+def error_kind(error: BaseException) -> Optional[str]:
+    """
+    Classify a failed upstream call: ``rate_limit`` (429), ``server_error`` (5xx or a
+    backend error without a status), ``timeout`` (timeouts and connection failures), or
+    ``None`` for errors that retrying cannot fix, such as invalid requests.
+    """
+    if isinstance(error, CircuitOpenError):
+        return None
+    if isinstance(error, BackendError):
+        if error.status_code == RATE_LIMITED:
+            return "rate_limit"
+        if error.status_code is None or error.status_code in SERVER_ERRORS:
+            return "server_error"
+        return None
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return "timeout"
+    return None
+
+
+class CircuitOpenError(BackendError):
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(f"Circuit open for {model}, retry in {retry_after:.1f}s", status_code=503,
+                         retry_after=retry_after)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at ``rate_per_minute`` and holding at most ``capacity``
+    tokens (default: one minute's worth). Waiters are served in arrival order.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1):
+        # A request larger than the bucket can never fit; let it through once the bucket is full
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def adjust(self, amount: float):
+        """Charge (or refund, when negative) ``amount`` tokens without waiting; the balance may go negative."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit: grows by ``increase`` per limit's worth of successful calls
+    and is multiplied by ``decrease_factor`` on an overload signal. Overload signals from
+    calls started before the last decrease are ignored, so one burst of 429s only backs
+    off once.
+
+    The limit starts at ``maximum``, which callers with a concurrency cap of their own
+    (the generation scheduler) may never reach. A decrease therefore starts from the
+    number of calls actually in flight when it was signalled, so the first back-off
+    takes effect.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1, initial: Optional[int] = None,
+                 increase: float = 1.0, decrease_factor: float = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(initial or maximum)
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.epoch = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> int:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            return self.epoch
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+    def on_overload(self, epoch: int) -> bool:
+        if epoch != self.epoch:
+            return False
+        self.epoch += 1
+        # The overloaded call has already been released, so it counts on top of in_flight
+        self.limit = max(self.minimum, min(self.limit, self.in_flight + 1) * self.decrease_factor)
+        return True
+
+
+class CircuitBreaker:
+    """
+    Open after ``failure_threshold`` consecutive failures and fail fast for
+    ``reset_timeout`` seconds, then let a single probe through (half-open): its success
+    closes the circuit and its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def check(self, model: str):
+        if self.state == CLOSED:
+            return
+        remaining = self._opened_at + self.reset_timeout - time.monotonic()
+        if self.state == OPEN and remaining <= 0:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        raise CircuitOpenError(model, max(remaining, 0.0))
+
+    def on_success(self) -> bool:
+        changed = self.state != CLOSED
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+        return changed
+
+    def on_failure(self) -> bool:
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+            self._probing = False
+            return True
+        return False
+
+    def on_neutral(self):
+        # A probe that failed for an unrelated reason (e.g. a bad request) says nothing about the outage
+        if self.state == HALF_OPEN:
+            self._probing = False
+
+
+class RetryPolicy:
+    """Full-jitter exponential backoff that never waits less than the server's ``retry_after``."""
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(backoff, retry_after or 0.0)
+
+
+class ModelLimiter:
+    """Request and token buckets, adaptive concurrency and a circuit breaker for one model."""
+
+    def __init__(self, model: str, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, max_concurrency: int = 64,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrencyLimiter(max_concurrency)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def _report(self):
+        if metrics.enabled:
+            metrics.CONCURRENCY_LIMIT.set(int(self.concurrency.limit), self.model)
+            metrics.CIRCUIT_OPEN.set(1 if self.breaker.state != CLOSED else 0, self.model)
+
+    async def acquire(self, estimated_tokens: int) -> int:
+        """Wait for capacity and return the concurrency epoch to pass to ``release``."""
+        self.breaker.check(self.model)
+        try:
+            if self.requests is not None:
+                await self.requests.acquire()
+            if self.tokens is not None:
+                await self.tokens.acquire(estimated_tokens)
+            return await self.concurrency.acquire()
+        except BaseException:
+            self.breaker.on_neutral()
+            raise
+
+    async def release(self, epoch: int, estimated_tokens: int, response: Optional[ModelResponse] = None,
+                      error: Optional[BaseException] = None):
+        await self.concurrency.release()
+        if response is not None:
+            self.concurrency.on_success()
+            if self.breaker.on_success():
+                logger.info(f"Circuit for {self.model} closed")
+            if self.tokens is not None:
+                used = (response.prompt_tokens or estimated_tokens) + (response.output_tokens or 0)
+                self.tokens.adjust(used - estimated_tokens)
+        else:
+            kind = error_kind(error) if error is not None else None
+            if kind == "rate_limit":
+                # A 429 says nothing about the outage; free the half-open probe slot for the next call
+                self.breaker.on_neutral()
+                if self.concurrency.on_overload(epoch):
+                    logger.info(f"Rate limited by {self.model}, concurrency limit now {int(self.concurrency.limit)}")
+            elif kind is not None:
+                if self.breaker.on_failure():
+                    logger.warning(f"Circuit for {self.model} opened after {self.breaker.failures} failures")
+            else:
+                self.breaker.on_neutral()
+        self._report()
+
+
+class RateLimiter:
+    """
+    Per-model ``ModelLimiter`` registry. ``requests_per_minute`` and
+    ``tokens_per_minute`` map model names to limits, with ``"*"`` as the default for
+    unlisted models; a missing limit means unlimited.
+    """
+
+    def __init__(self, requests_per_minute: Optional[Dict[str, float]] = None,
+                 tokens_per_minute: Optional[Dict[str, float]] = None, max_concurrency: int = 64,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.requests_per_minute = requests_per_minute or {}
+        self.tokens_per_minute = tokens_per_minute or {}
+        self.max_concurrency = max_concurrency
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._models: Dict[str, ModelLimiter] = {}
+
+    @classmethod
+    def from_config(cls) -> "RateLimiter":
+        return cls(
+            parse_model_limits(Config.MODEL_REQUESTS_PER_MINUTE),
+            parse_model_limits(Config.MODEL_TOKENS_PER_MINUTE),
+            max_concurrency=Config.ADAPTIVE_CONCURRENCY_MAX,
+            failure_threshold=Config.CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=Config.CIRCUIT_RESET_TIMEOUT,
+        )
+
+    @staticmethod
+    def _limit(limits: Dict[str, float], model: str) -> Optional[float]:
+        return limits.get(model, limits.get("*"))
+
+    def for_model(self, model: str) -> ModelLimiter:
+        limiter = self._models.get(model)
+        if limiter is None:
+            limiter = self._models[model] = ModelLimiter(
+                model, self._limit(self.requests_per_minute, model), self._limit(self.tokens_per_minute, model),
+                self.max_concurrency, self.failure_threshold, self.reset_timeout
+            )
+        return limiter
@@ -0,0 +1,122 @@
+import asyncio
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+from src import metrics
+from src.config import Config
+
+TaskFactory = Callable[[], Awaitable[Any]]
+
+
+class GenerationScheduler:
+    """
+    Run generation tasks concurrently under a fixed concurrency cap.
+
+    Tasks are pulled lazily from one or more sources (iterables of zero-argument
+    coroutine factories), round-robin across sources so that one large request in a
+    batch cannot starve the others. Results are yielded as ``(source_index, item_index,
+    result)`` tuples either in completion order or in submission order.
+
+    The concurrency cap is shared by all ``run`` calls on the same event loop, so
+    concurrent requests on one scheduler cannot exceed it together.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, buffer_factor: int = 4):
+        self.max_concurrency = max_concurrency or Config.MAX_CONCURRENT_TASKS
+        if self.max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        # Upper bound on tasks that are running or finished but not yet yielded.
+        self.window = self.max_concurrency * max(buffer_factor, 1)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # A semaphore belongs to one event loop; a scheduler reused under a new loop
+        # (e.g. successive asyncio.run calls) gets a fresh one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    @staticmethod
+    def _round_robin(sources: Sequence[Iterable[TaskFactory]]) -> Iterator[Tuple[int, int, TaskFactory]]:
+        iterators = [(source_index, iter(source)) for source_index, source in enumerate(sources)]
+        counters = [0] * len(iterators)
+        while iterators:
+            remaining = []
+            for source_index, iterator in iterators:
+                try:
+                    factory = next(iterator)
+                except StopIteration:
+                    continue
+                yield source_index, counters[source_index], factory
+                counters[source_index] += 1
+                remaining.append((source_index, iterator))
+            iterators = remaining
+
+    async def run(
+        self, sources: Sequence[Iterable[TaskFactory]], ordered: bool = False
+    ) -> AsyncGenerator[Tuple[int, int, Any], None]:
+        """
+        Yield ``(source_index, item_index, result)`` for every task of every source.
+
+        An exception raised by a task is propagated to the caller and all outstanding
+        tasks are cancelled; the same happens when the consumer stops iterating early.
+        """
+        semaphore = self._get_semaphore()
+        pending = self._round_robin(sources)
+        exhausted = False
+        tasks: Dict[asyncio.Task, Tuple[int, int, int]] = {}
+        completed: Dict[int, Tuple[int, int, Any]] = {}
+        next_sequence = 0
+        next_to_yield = 0
+
+        async def execute(factory: TaskFactory) -> Any:
+            if not metrics.enabled:
+                async with semaphore:
+                    return await factory()
+            metrics.SCHEDULER_QUEUED.inc()
+            try:
+                await semaphore.acquire()
+            finally:
+                metrics.SCHEDULER_QUEUED.dec()
+            metrics.SCHEDULER_IN_FLIGHT.inc()
+            try:
+                return await factory()
+            finally:
+                metrics.SCHEDULER_IN_FLIGHT.dec()
+                semaphore.release()
+
+        def fill():
+            nonlocal exhausted, next_sequence
+            while not exhausted and len(tasks) + len(completed) < self.window:
+                try:
+                    source_index, item_index, factory = next(pending)
+                except StopIteration:
+                    exhausted = True
+                    break
+                task = asyncio.ensure_future(execute(factory))
+                tasks[task] = (next_sequence, source_index, item_index)
+                next_sequence += 1
+
+        try:
+            fill()
+            while tasks or completed:
+                if ordered and next_to_yield in completed:
+                    yield completed.pop(next_to_yield)
+                    next_to_yield += 1
+                    fill()
+                    continue
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    sequence, source_index, item_index = tasks.pop(task)
+                    result = (source_index, item_index, task.result())
+                    if ordered:
+                        completed[sequence] = result
+                    else:
+                        yield result
+                fill()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
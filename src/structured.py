@@ -0,0 +1,56 @@
+import json
+from typing import Any, Dict, List
+
+STRUCTURED_DIALOGUE_PROMPT = (
+    "Write a {num_turns}-turn dialogue between a human and an AI assistant about the following topic. "
+    "In each turn the human speaks first and the AI answers. Return JSON with a \"turns\" array of "
+    "exactly {num_turns} objects, each with a \"human\" and an \"ai\" string.\n\nTopic: {prompt}"
+)
+
+
+class MalformedDialogueError(ValueError):
+    pass
+
+
+def dialogue_schema(num_turns: int) -> Dict[str, Any]:
+    """JSON schema of a structured dialogue with exactly ``num_turns`` human/AI turn pairs."""
+    return {
+        "type": "object",
+        "properties": {
+            "turns": {
+                "type": "array",
+                "min_items": num_turns,
+                "max_items": num_turns,
+                "items": {
+                    "type": "object",
+                    "properties": {"human": {"type": "string"}, "ai": {"type": "string"}},
+                    "required": ["human", "ai"],
+                },
+            }
+        },
+        "required": ["turns"],
+    }
+
+
+def parse_dialogue(text: str, num_turns: int) -> List[Dict[str, Any]]:
+    """
+    Parse a structured dialogue into the generator's conversation format, raising
+    ``MalformedDialogueError`` unless it holds exactly ``num_turns`` turns with non-empty
+    ``human`` and ``ai`` strings.
+    """
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise MalformedDialogueError(f"Dialogue is not valid JSON: {e}") from e
+    turns = data.get("turns") if isinstance(data, dict) else None
+    if not isinstance(turns, list) or len(turns) != num_turns:
+        raise MalformedDialogueError(f"Expected {num_turns} turns, got {len(turns) if isinstance(turns, list) else 0}")
+    conversation = []
+    for turn in turns:
+        human = turn.get("human") if isinstance(turn, dict) else None
+        ai = turn.get("ai") if isinstance(turn, dict) else None
+        if not isinstance(human, str) or not isinstance(ai, str) or not human.strip() or not ai.strip():
+            raise MalformedDialogueError(f"Turn is missing a human or ai message: {turn!r}")
+        conversation.append({"input": {"content": human.strip()}})
+        conversation.append({"output": {"content": ai.strip()}})
+    return conversation
@@ -0,0 +1,115 @@
+import math
+import random
+from bisect import bisect_right
+from itertools import accumulate
+from string import Formatter
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+SAMPLINGS = ("product", "shuffled", "random", "stratified")
+
+# Fractional parts of the square roots of these primes are the per-variable steps of
+# the stratified (Kronecker) sequence; they are pairwise rationally independent
+_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71, 73, 79, 83, 89, 97)
+
+Values = Union[Sequence[Any], Dict[Any, float]]
+
+
+class PromptTemplate:
+    """
+    Prompt template with ``{name}`` placeholders and the values each variable takes.
+
+    Values are given as a list (equal weights) or as a dict mapping each value to its
+    weight. A combination of values is addressed by its mixed-radix index into the
+    Cartesian product, so a template with millions of combinations is never expanded in
+    memory; ``sample`` yields prompts lazily.
+    """
+
+    def __init__(self, template: str, variables: Dict[str, Values]):
+        self.template = template
+        placeholders = {name for _, name, _, _ in Formatter().parse(template) if name}
+        missing = placeholders - set(variables)
+        if missing:
+            raise ValueError(f"Template variables without values: {', '.join(sorted(missing))}")
+        self.names: List[str] = list(variables)
+        self.values: List[List[Any]] = []
+        self._cumulative: List[List[float]] = []
+        for name, values in variables.items():
+            weights = list(values.values()) if isinstance(values, dict) else [1.0] * len(values)
+            if not weights:
+                raise ValueError(f"Template variable {name} has no values")
+            if any(weight <= 0 for weight in weights):
+                raise ValueError(f"Weights of template variable {name} must be positive")
+            total = sum(weights)
+            self.values.append(list(values))
+            self._cumulative.append([weight / total for weight in accumulate(weights)])
+        self.size = math.prod(len(values) for values in self.values)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PromptTemplate":
+        return cls(data["template"], data["variables"])
+
+    def combination(self, index: int) -> Dict[str, Any]:
+        """Decode a mixed-radix index into the product; the last variable varies fastest."""
+        if not 0 <= index < self.size:
+            raise IndexError(f"Combination {index} out of range for {self.size} combinations")
+        combination = {}
+        for name, values in zip(reversed(self.names), reversed(self.values)):
+            index, digit = divmod(index, len(values))
+            combination[name] = values[digit]
+        return {name: combination[name] for name in self.names}
+
+    def render(self, variables: Dict[str, Any]) -> str:
+        return self.template.format(**variables)
+
+    def _weighted(self, points: Sequence[float]) -> Dict[str, Any]:
+        # Map one point of the unit interval per variable to a value through its cumulative weights
+        return {
+            name: values[min(bisect_right(cumulative, point), len(values) - 1)]
+            for name, values, cumulative, point in zip(self.names, self.values, self._cumulative, points)
+        }
+
+    def sample(
+        self, num_samples: Optional[int] = None, sampling: str = "product", seed: Optional[int] = 0
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Lazily yield ``(prompt, variables)`` pairs.
+
+        - ``product``: every combination in index order (the first ``num_samples`` if given).
+        - ``shuffled``: distinct combinations in a seeded pseudo-random order, through an
+          affine permutation of the indexes.
+        - ``random``: each variable drawn independently by weight, with replacement.
+        - ``stratified``: like ``random``, but drawn from a low-discrepancy sequence, so
+          every prefix of the stream matches the weights of each variable (and of each
+          pair of variables) far more closely than random draws.
+
+        ``random`` and ``stratified`` need ``num_samples``.
+        """
+        if sampling not in SAMPLINGS:
+            raise ValueError(f"Invalid sampling: {sampling}")
+        rng = random.Random(seed)
+        if sampling in ("product", "shuffled"):
+            count = self.size if num_samples is None else min(num_samples, self.size)
+            step, offset = 1, 0
+            if sampling == "shuffled" and self.size > 1:
+                step = rng.randrange(1, self.size)
+                while math.gcd(step, self.size) != 1:
+                    step = rng.randrange(1, self.size)
+                offset = rng.randrange(self.size)
+            for position in range(count):
+                variables = self.combination((offset + position * step) % self.size)
+                yield self.render(variables), variables
+            return
+        if num_samples is None:
+            raise ValueError(f"{sampling} sampling needs num_samples")
+        if sampling == "stratified":
+            if len(self.names) > len(_PRIMES):
+                raise ValueError(f"Stratified sampling supports at most {len(_PRIMES)} variables")
+            steps = [math.sqrt(prime) % 1 for prime in _PRIMES[:len(self.names)]]
+            shifts = [rng.random() for _ in self.names]
+        for position in range(num_samples):
+            if sampling == "random":
+                points = [rng.random() for _ in self.names]
+            else:
+                points = [(shift + position * step) % 1 for shift, step in zip(shifts, steps)]
+            variables = self._weighted(points)
+            yield self.render(variables), variables
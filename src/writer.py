@@ -0,0 +1,276 @@
+import os
+import gzip
+import json
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional, Union
+
+COMPRESSIONS = ("none", "gzip", "zstd")
+OUTPUT_FORMATS = ("jsonl", "parquet")
+
+_EXTENSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class _HashingFile:
+    """Write-through file wrapper that keeps a running SHA-256 and size of what reaches disk."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+    def writable(self) -> bool:
+        return True
+
+    @property
+    def closed(self) -> bool:
+        return self.raw.closed
+
+    def close(self):
+        pass  # The shard owns and closes the raw file
+
+
+def _parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("messages", pa.list_(pa.struct([("role", pa.string()), ("content", pa.string())]))),
+        ("metadata", pa.string()),
+    ])
+
+
+class _Shard:
+    def __init__(self, path: str, output_format: str, compression: str):
+        self.path = path
+        self.temp_path = f"{path}.tmp"
+        self.output_format = output_format
+        self.compression = compression
+        self.records = 0
+        self.uncompressed_bytes = 0
+        self._raw = open(self.temp_path, "wb")
+        self._hashing = _HashingFile(self._raw)
+        if output_format == "parquet":
+            self._parquet = None
+            self._stream = None
+        elif compression == "gzip":
+            self._stream = gzip.GzipFile(fileobj=self._hashing, mode="wb", mtime=0)
+        elif compression == "zstd":
+            import zstandard
+
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._hashing, closefd=False)
+        else:
+            self._stream = self._hashing
+
+    def write_lines(self, data: bytes, records: int):
+        self._stream.write(data)
+        self.records += records
+        self.uncompressed_bytes += len(data)
+
+    def write_rows(self, rows: List[Dict[str, Any]], encoded_bytes: int):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(rows, schema=_parquet_schema())
+        if self._parquet is None:
+            codec = {"none": "none", "gzip": "gzip", "zstd": "zstd"}[self.compression]
+            self._parquet = pq.ParquetWriter(self._hashing, _parquet_schema(), compression=codec)
+        self._parquet.write_table(table)
+        self.records += len(rows)
+        self.uncompressed_bytes += encoded_bytes
+
+    def finalize(self) -> Dict[str, Any]:
+        if self.output_format == "parquet":
+            if self._parquet is None:
+                import pyarrow.parquet as pq
+
+                self._parquet = pq.ParquetWriter(self._hashing, _parquet_schema(), compression="none")
+            self._parquet.close()
+        elif self._stream is not self._hashing:
+            self._stream.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        os.replace(self.temp_path, self.path)
+        return {
+            "path": os.path.basename(self.path),
+            "records": self.records,
+            "bytes": self._hashing.size,
+            "uncompressed_bytes": self.uncompressed_bytes,
+            "sha256": self._hashing.sha256.hexdigest(),
+        }
+
+    def abort(self):
+        self._raw.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class ShardedDatasetWriter:
+    """
+    Write dataset records into rotating, optionally compressed shards.
+
+    Records are buffered and committed in groups (``flush_records`` records or
+    ``flush_bytes`` bytes, whichever comes first) on a worker thread. A shard is rotated
+    once it holds ``max_records_per_shard`` records or ``max_bytes_per_shard``
+    uncompressed bytes; it is written under a temporary name and renamed into place
+    when finished. ``manifest.json`` lists every finished shard with its record count,
+    size and SHA-256, and is rewritten atomically after each shard.
+
+    ``parquet`` output stores the fine-tuning ``messages`` format (with ``metadata`` as a
+    JSON string) and requires ``pyarrow``; ``zstd`` compression requires ``zstandard``.
+    """
+
+    def __init__(
+        self, output_dir: str, prefix: str = "part", output_format: str = "jsonl", compression: str = "none",
+        max_records_per_shard: Optional[int] = None, max_bytes_per_shard: Optional[int] = None,
+        flush_records: int = 256, flush_bytes: int = 1 << 20
+    ):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Invalid output format: {output_format}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Invalid compression: {compression}")
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.output_format = output_format
+        self.compression = compression
+        self.max_records_per_shard = max_records_per_shard
+        self.max_bytes_per_shard = max_bytes_per_shard
+        self.flush_records = flush_records
+        self.flush_bytes = flush_bytes
+        self.shards: List[Dict[str, Any]] = []
+        self._shard: Optional[_Shard] = None
+        self._buffer: List[Any] = []
+        self._buffer_bytes = 0
+        self._lock = asyncio.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.output_dir, "manifest.json")
+
+    @property
+    def paths(self) -> List[str]:
+        return [os.path.join(self.output_dir, shard["path"]) for shard in self.shards]
+
+    def _shard_path(self, index: int) -> str:
+        if self.output_format == "parquet":
+            extension = ".parquet"
+        else:
+            extension = ".jsonl" + _EXTENSIONS[self.compression]
+        return os.path.join(self.output_dir, f"{self.prefix}-{index:05d}{extension}")
+
+    def _shard_full(self) -> bool:
+        shard = self._shard
+        return (
+            (self.max_records_per_shard is not None and shard.records >= self.max_records_per_shard)
+            or (self.max_bytes_per_shard is not None and shard.uncompressed_bytes >= self.max_bytes_per_shard)
+        )
+
+    def _write_manifest(self):
+        manifest = {
+            "format": self.output_format,
+            "compression": self.compression,
+            "records": sum(shard["records"] for shard in self.shards),
+            "shards": self.shards,
+        }
+        temp_path = f"{self.manifest_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_path)
+
+    def _finalize_shard(self):
+        self.shards.append(self._shard.finalize())
+        self._shard = None
+        self._write_manifest()
+
+    def _commit(self, entries: List[Any]):
+        """Write a group of encoded records, rotating shards at the configured limits."""
+        position = 0
+        while position < len(entries):
+            if self._shard is None:
+                self._shard = _Shard(self._shard_path(len(self.shards)), self.output_format, self.compression)
+            # Take as many records as the current shard can still hold
+            room = len(entries) - position
+            if self.max_records_per_shard is not None:
+                room = min(room, self.max_records_per_shard - self._shard.records)
+            group = []
+            group_bytes = 0
+            for entry in entries[position:position + room]:
+                group.append(entry)
+                group_bytes += entry[1]
+                if (self.max_bytes_per_shard is not None
+                        and self._shard.uncompressed_bytes + group_bytes >= self.max_bytes_per_shard):
+                    break
+            if self.output_format == "parquet":
+                self._shard.write_rows([row for row, _ in group], group_bytes)
+            else:
+                self._shard.write_lines(b"".join(line for line, _ in group), len(group))
+            position += len(group)
+            if self._shard_full():
+                self._finalize_shard()
+
+    def _encode(self, record: Union[Dict[str, Any], str]) -> Any:
+        if isinstance(record, str):
+            if self.output_format == "parquet":
+                raise ValueError("Encoded JSON lines can only be written to JSONL output")
+            line = (record if record.endswith("\n") else record + "\n").encode("utf-8")
+            return line, len(line)
+        if self.output_format == "parquet":
+            if "messages" not in record:
+                raise ValueError("Parquet output requires records in the fine-tuning messages format")
+            metadata = json.dumps(record.get("metadata", {}))
+            row = {"messages": record["messages"], "metadata": metadata}
+            size = len(metadata) + sum(len(message.get("content", "")) for message in record["messages"])
+            return row, size
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        return line, len(line)
+
+    async def write(self, record: Union[Dict[str, Any], str]):
+        """Buffer ``record``; an already-encoded JSON line is accepted for JSONL output."""
+        entry = self._encode(record)
+        self._buffer.append(entry)
+        self._buffer_bytes += entry[1]
+        if len(self._buffer) >= self.flush_records or self._buffer_bytes >= self.flush_bytes:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            entries, self._buffer, self._buffer_bytes = self._buffer, [], 0
+            if entries:
+                await asyncio.to_thread(self._commit, entries)
+
+    async def close(self) -> Dict[str, Any]:
+        """Flush buffered records, finish the open shard and return the manifest."""
+        await self.flush()
+        async with self._lock:
+            if self._shard is not None:
+                await asyncio.to_thread(self._finalize_shard)
+            elif not self.shards:
+                await asyncio.to_thread(self._write_manifest)
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    async def abort(self):
+        self._buffer = []
+        if self._shard is not None:
+            self._shard.abort()
+            self._shard = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            await self.close()
+        else:
+            await self.abort()